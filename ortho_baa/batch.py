@@ -0,0 +1,255 @@
+from __future__ import annotations
+import os, time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from PIL import Image, UnidentifiedImageError
+from .logic import CropParams, load_image, load_image_reduced, crop_top_then_bottom, open_image, map_pair
+from .exporters import export_outputs, output_paths, half_target_px, jpeg_over_budget, PdfBook
+from .utils import parse_patient_from_filename
+from . import trace
+
+FORMAT_SUFFIX = {"PDF": ".pdf", "JPEG": ".jpg"}
+# Decoded frame + cropped copy + RGB copy are alive at the same time in export_pair.
+WORKING_COPIES = 3
+
+@dataclass(frozen=True)
+class BatchSettings:
+    before_crop: CropParams
+    after_crop: CropParams
+    fmt: str = "PDF"
+    scale_factor: float = 0.85
+    quality: int = 92
+    reduced_decode: bool = False  # decode only as many pixels as the output needs
+    pdf_dpi: Optional[float] = None  # None embeds images at source resolution
+    pdf_image_format: str = "flate"
+    pdf_jpeg_quality: int = 90
+    extra_outputs: Tuple[str, ...] = ()  # more kinds (PDF, JPEG, THUMB) written next to each output from the same decode
+    thumb_size: int = 800  # longest side of the THUMB output, px
+    thumb_format: str = "JPEG"  # or "WEBP"
+    jpeg_max_kb: int = 0  # > 0: highest JPEG quality (up to ``quality``) that fits in this many KB
+    jpeg_progressive: bool = False
+    jpeg_subsampling: str = ""  # "4:4:4", "4:2:2" or "4:2:0"; "" = Pillow's default
+
+    def jpeg_options(self) -> Dict[str, object]:
+        return {"max_bytes": self.jpeg_max_kb * 1024 or None, "progressive": self.jpeg_progressive,
+                "subsampling": self.jpeg_subsampling or None}
+
+    def output_kinds(self) -> Tuple[str, ...]:
+        return (self.fmt,) + tuple(k for k in dict.fromkeys(self.extra_outputs) if k != self.fmt)
+
+@dataclass
+class PairJob:
+    before: Path
+    after: Path
+    stem: str
+    out_path: Path
+
+@dataclass
+class PairResult:
+    job: PairJob
+    ok: bool
+    output: Optional[Path] = None
+    error: str = ""
+    timings: Dict[str, float] = field(default_factory=dict)
+    extra_outputs: List[Path] = field(default_factory=list)
+    warning: str = ""  # exported, but not as asked (e.g. a JPEG over its size target)
+
+    def as_dict(self) -> Dict[str, object]:
+        """JSON-ready summary, as printed by the CLI and returned by the render service."""
+        job = self.job
+        return {
+            "stem": job.stem, "before": str(job.before), "after": str(job.after),
+            "status": "ok" if self.ok else "error",
+            "output": str(self.output) if self.output else None, "error": self.error or None,
+            **({"also": [str(p) for p in self.extra_outputs]} if self.extra_outputs else {}),
+            **({"warning": self.warning} if self.warning else {}),
+            "timings": {k: round(v, 4) for k, v in self.timings.items()},
+        }
+
+def make_jobs(folder: Path, out_dir: Path, fmt: str = "PDF") -> List[PairJob]:
+    """All jobs for ``folder`` (not its subfolders) in name order, paired the same way as ``iter_jobs``."""
+    return list(iter_jobs(folder, out_dir, fmt, ordered=True))
+
+def iter_jobs(folder: Path, out_dir: Path, fmt: str = "PDF", recursive: bool = False,
+              use_cache: bool = True, ordered: bool = False) -> Iterator[PairJob]:
+    """Jobs from the pairing index, produced while the folder is still being scanned.
+
+    Pairs found in subfolders are written to the same subfolder below ``out_dir``.
+    ``ordered`` sorts each folder's pairs by name, at the cost of listing it in full first.
+    """
+    from .pairindex import iter_pairs
+    suffix = FORMAT_SUFFIX.get(fmt, ".pdf")
+    root = Path(os.path.abspath(folder))
+    for b, a, stem in iter_pairs(root, recursive=recursive, use_cache=use_cache, ordered=ordered):
+        yield PairJob(b, a, stem, out_dir / b.parent.relative_to(root) / f"{stem}_BeforeAndAfter{suffix}")
+
+class _LoadError(Exception):
+    pass
+
+def _prepare_half(p: Path, params: CropParams, settings: BatchSettings) -> Tuple[Image.Image, float, float]:
+    """Load and crop one image: (cropped image, load seconds, crop seconds)."""
+    t = time.perf_counter()
+    if settings.reduced_decode:
+        res = load_image_reduced(p, half_target_px(settings.scale_factor), params)
+        im, params = res or (None, params)
+    else:
+        im = load_image(p)
+    t_load = time.perf_counter() - t
+    if im is None:
+        raise _LoadError(f"Could not load: {p}")
+    t = time.perf_counter()
+    cropped = crop_top_then_bottom(im, params)
+    if cropped is not im:
+        im.close()  # the full frame is the biggest thing a pair holds; don't wait for the caller to drop it
+    return cropped, t_load, time.perf_counter() - t
+
+def _prepare_pair(job: PairJob, settings: BatchSettings, timings: Dict[str, float]) -> Tuple[Image.Image, Image.Image]:
+    """Load and crop both images of a pair concurrently, recording load/crop timings."""
+    (b_eff, b_load, b_crop), (a_eff, a_load, a_crop) = map_pair(
+        lambda half: _prepare_half(half[0], half[1], settings),
+        (job.before, settings.before_crop), (job.after, settings.after_crop))
+    timings["load"] = max(b_load, a_load)  # wall time; the halves overlap
+    timings["crop"] = max(b_crop, a_crop)
+    return b_eff, a_eff
+
+def _failure(job: PairJob, e: Exception, timings: Dict[str, float]) -> PairResult:
+    error = str(e) if isinstance(e, _LoadError) else f"{type(e).__name__}: {e}"
+    return PairResult(job, False, error=error, timings=timings)
+
+def export_pair(job: PairJob, settings: BatchSettings) -> PairResult:
+    timings: Dict[str, float] = {}
+    try:
+        with trace.span("pair", stem=job.stem):
+            return _export_pair(job, settings, timings)
+    except Exception as e:
+        return _failure(job, e, timings)
+
+def _export_pair(job: PairJob, settings: BatchSettings, timings: Dict[str, float]) -> PairResult:
+    b_eff, a_eff = _prepare_pair(job, settings, timings)
+    t = time.perf_counter()
+    job.out_path.parent.mkdir(parents=True, exist_ok=True)
+    kinds = settings.output_kinds()
+    try:
+        outs = export_outputs(output_paths(job.out_path, kinds, settings.thumb_format), b_eff, a_eff,
+                              scale_factor=settings.scale_factor, quality=settings.quality, thumb_size=settings.thumb_size,
+                              pdf={"dpi": settings.pdf_dpi, "image_format": settings.pdf_image_format,
+                                   "jpeg_quality": settings.pdf_jpeg_quality}, jpeg=settings.jpeg_options())
+    finally:
+        b_eff.close(); a_eff.close()  # a failed pair's traceback would otherwise keep both alive
+    timings["export"] = time.perf_counter() - t
+    warning = jpeg_over_budget(outs["JPEG"], settings.jpeg_options()["max_bytes"]) if "JPEG" in outs else ""
+    return PairResult(job, True, output=outs[settings.fmt], timings=timings, extra_outputs=[outs[k] for k in kinds[1:]],
+                      warning=warning)
+
+def bookmark_title(job: PairJob) -> str:
+    info = parse_patient_from_filename(job.before.name) or parse_patient_from_filename(job.after.name)
+    if info:
+        return f"{info['id']} {info['first']} {info['last']}"
+    return job.stem
+
+def export_book(jobs: Iterable[PairJob], settings: BatchSettings, out_path: Path, bookmarks: bool = True) -> Iterator[PairResult]:
+    """Write every pair as one page of a single PDF, yielding a result per pair as its page is written.
+
+    Pairs are processed in order in this process; each page is flushed to disk
+    before the next pair is loaded. Consecutive pairs of the same patient share
+    one bookmark. ``settings.extra_outputs`` does not apply here.
+    """
+    with PdfBook(out_path, scale_factor=settings.scale_factor, dpi=settings.pdf_dpi,
+                 image_format=settings.pdf_image_format, jpeg_quality=settings.pdf_jpeg_quality) as book:
+        last_title = None
+        for job in jobs:
+            timings: Dict[str, float] = {}
+            try:
+                b_eff, a_eff = _prepare_pair(job, settings, timings)
+                t = time.perf_counter()
+                title = bookmark_title(job) if bookmarks else None
+                try:
+                    book.add_page(b_eff, a_eff, title if title != last_title else None)
+                finally:
+                    b_eff.close(); a_eff.close()  # the page is on disk; don't carry the pixels into the next pair
+                last_title = title
+                timings["export"] = time.perf_counter() - t
+                yield PairResult(job, True, output=out_path, timings=timings)
+            except Exception as e:
+                yield _failure(job, e, timings)
+
+# ---------------- Parallel batch ----------------
+
+def image_footprint(p: Path) -> int:
+    """Decoded size in bytes, from the header only (no pixel data is read)."""
+    try:
+        with open_image(p) as im:
+            w, h = im.size
+            bands = len(im.getbands())
+    except (UnidentifiedImageError, OSError):
+        return 0
+    return w * h * max(bands, 3)
+
+def estimate_pair_bytes(job: PairJob) -> int:
+    return (image_footprint(job.before) + image_footprint(job.after)) * WORKING_COPIES
+
+def default_mem_budget() -> int:
+    # Half of physical RAM; 2 GiB where the platform won't tell us.
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 2
+    except (AttributeError, ValueError, OSError):
+        return 2 * 1024 ** 3
+
+def _start_pool(workers: int) -> ProcessPoolExecutor:
+    # Spawn, not fork: the GUI calls this from a worker thread, and forking a process with Qt threads running can deadlock.
+    # Spawned workers start without the parent's trace sinks, so they are installed again there.
+    return ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                               initializer=trace.install_worker_sinks, initargs=(trace.log_paths(),))
+
+def run_parallel_batch(jobs: Iterable[PairJob], settings: BatchSettings, workers: Optional[int] = None,
+                       mem_budget: Optional[int] = None) -> Iterator[PairResult]:
+    """Export pairs on a process pool, yielding results as they finish.
+
+    Jobs start in order, but only while the estimated decoded size of everything
+    in flight stays under ``mem_budget`` bytes. A job larger than the whole budget
+    still runs, on its own. ``jobs`` is consumed lazily, so it can be a scan that
+    is still running.
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    budget = mem_budget or default_mem_budget()
+    source = iter(jobs)
+    head: Optional[Tuple[PairJob, int]] = None
+    running: Dict[object, Tuple[PairJob, int]] = {}
+    in_use = 0
+
+    ex = _start_pool(workers)
+    try:
+        while True:
+            while len(running) < workers:
+                if head is None:
+                    job = next(source, None)
+                    if job is None:
+                        break
+                    head = (job, estimate_pair_bytes(job))
+                if running and in_use + head[1] > budget:
+                    break
+                try:
+                    fut = ex.submit(export_pair, head[0], settings)
+                except BrokenProcessPool:
+                    # A worker died (e.g. the OOM killer); its pairs fail below, the rest go to a fresh pool.
+                    ex.shutdown(wait=False, cancel_futures=True)
+                    ex = _start_pool(workers)
+                    fut = ex.submit(export_pair, head[0], settings)
+                running[fut] = head
+                in_use += head[1]; head = None
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                job, cost = running.pop(fut); in_use -= cost
+                try:
+                    yield fut.result()
+                except Exception as e:  # worker died (e.g. killed by the OOM killer)
+                    yield PairResult(job, False, error=f"{type(e).__name__}: {e}")
+    finally:
+        ex.shutdown(wait=True, cancel_futures=True)
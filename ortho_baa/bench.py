@@ -0,0 +1,327 @@
+from __future__ import annotations
+import argparse, json, math, os, platform, statistics, subprocess, sys, tempfile, time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from PIL import Image
+from .config import STARTUP_PROBE_ENV
+
+# Benchmarks for the export pipeline: python -m ortho_baa.bench --help
+#
+# Synthetic photos are generated once into a work folder and reused. Every
+# (format, size) case runs in a fresh spawned process so its peak RSS is its
+# own; each stage is timed ``repeat`` times and the median and minimum kept.
+# With --baseline, medians are compared against an earlier results file and the
+# exit code is 1 if any stage got slower than the threshold. --startup times
+# process start instead: `ortho-baa --help`, `ortho-baa batch --help` and the
+# GUI up to its first shown window. --lifecycle runs a long in-process batch
+# (per-pair files and one PDF) and fails if peak RSS or the number of open
+# files keeps growing with the pair count, i.e. if images are leaked.
+
+FORMATS = {"png": ".png", "jpeg": ".jpg", "tiff": ".tif", "webp": ".webp", "heic": ".heic"}
+DEFAULT_SIZES = [2, 12, 24, 50]  # megapixels
+MIN_DELTA = 0.005  # seconds; smaller changes are timer noise, whatever the percentage
+RSS_SLACK_MB = 32  # peak RSS may still rise this much in the second half of a lifecycle run (allocator noise)
+
+def heic_available() -> bool:
+    from .logic import ensure_heif_opener
+    return ensure_heif_opener()
+
+def mp_size(mp: float) -> Tuple[int, int]:
+    """4:3 frame of ``mp`` megapixels, like a DSLR/phone photo."""
+    w = int(math.sqrt(mp * 1e6 * 4 / 3))
+    return w, int(w * 3 / 4)
+
+def synthetic_image(size: Tuple[int, int], seed: int = 0) -> Image.Image:
+    # Smooth gradients with sensor-like noise on top: compresses roughly like a photo,
+    # unlike flat colour (too easy) or pure noise (too hard).
+    base = Image.merge("RGB", [
+        Image.linear_gradient("L").resize(size),
+        Image.radial_gradient("L").resize(size),
+        Image.linear_gradient("L").transpose(Image.Transpose.ROTATE_90 if seed else Image.Transpose.ROTATE_270).resize(size),
+    ])
+    noise = Image.effect_noise(size, 24).convert("RGB")
+    return Image.blend(base, noise, 0.25)
+
+def ensure_image(workdir: Path, fmt: str, mp: float, role: str) -> Path:
+    p = workdir / f"{mp:g}mp_{role}{FORMATS[fmt]}"
+    if p.exists():
+        return p
+    img = synthetic_image(mp_size(mp), seed=role == "after")
+    tmp = p.with_name(p.stem + ".tmp" + p.suffix)
+    opts: Dict[str, Any] = {"jpeg": {"quality": 92}, "webp": {"quality": 90}, "heic": {"quality": 85},
+                            "tiff": {"compression": "tiff_lzw"}}.get(fmt, {})
+    img.save(tmp, format="HEIF" if fmt == "heic" else fmt.upper(), **opts)
+    os.replace(tmp, p)
+    return p
+
+def ensure_multipage_tiff(workdir: Path, mp: float, role: str) -> Path:
+    """A two-page TIFF (the second page a half-size preview, as some scanners write): Pillow keeps
+    such files open after load(), which is what the lifecycle run checks for."""
+    p = workdir / f"{mp:g}mp_{role}_pages.tif"
+    if not p.exists():
+        img = synthetic_image(mp_size(mp), seed=role == "after")
+        tmp = p.with_name(p.stem + ".tmp.tif")
+        img.save(tmp, "TIFF", compression="tiff_lzw", save_all=True, append_images=[img.reduce(2)])
+        os.replace(tmp, p)
+    return p
+
+def open_files() -> Optional[int]:
+    for d in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return len(os.listdir(d))
+        except OSError:
+            continue
+    return None  # Windows
+
+def _timed(fn: Callable[[], Any], repeat: int) -> Tuple[Dict[str, float], Any]:
+    times: List[float] = []; out = None
+    for _ in range(repeat):
+        out = None  # drop the previous result before making the next one
+        t = time.perf_counter(); out = fn(); times.append(time.perf_counter() - t)
+    return {"median": statistics.median(times), "min": min(times)}, out
+
+def _mb(v: Optional[float]) -> str:
+    return f"{v:.0f} MB" if v is not None else "n/a"
+
+def peak_rss_mb(children: bool = False) -> Optional[float]:
+    """Peak RSS of this process, or with ``children`` of its largest finished child (e.g. a pool worker)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 2 if sys.platform == "darwin" else rss / 1024  # bytes on macOS, KiB elsewhere
+
+def run_case(before: Path, after: Path, repeat: int) -> Dict[str, Any]:
+    """Time every stage on one pair. Runs in its own process."""
+    from .logic import CropParams, load_image, load_image_reduced, crop_top_then_bottom
+    from .exporters import compose_preview_image, export_pdf, export_jpeg, half_target_px
+    heic_available()
+    stages: Dict[str, Dict[str, float]] = {}
+    with tempfile.TemporaryDirectory() as out:
+        out_dir = Path(out)
+        stages["load"], b = _timed(lambda: load_image(before), repeat)
+        a = load_image(after)
+        params = CropParams(True, int(b.height * 0.6), int(b.height * 0.3))
+        stages["load_reduced"], _ = _timed(lambda: load_image_reduced(before, half_target_px(), params), repeat)
+        stages["crop"], b_eff = _timed(lambda: crop_top_then_bottom(b, params), repeat)
+        a_eff = crop_top_then_bottom(a, params)
+        stages["compose"], _ = _timed(lambda: compose_preview_image(b_eff, a_eff), repeat)
+        stages["export_pdf"], _ = _timed(lambda: export_pdf(out_dir / "pair.pdf", b_eff, a_eff), repeat)
+        stages["export_pdf_jpeg"], _ = _timed(
+            lambda: export_pdf(out_dir / "pair_jpeg.pdf", b_eff, a_eff, dpi=300, image_format="jpeg"), repeat)
+        stages["export_jpeg"], _ = _timed(lambda: export_jpeg(out_dir / "pair.jpg", b_eff, a_eff), repeat)
+        sizes = {p.name: p.stat().st_size for p in out_dir.iterdir()}
+    return {"source": [b.width, b.height], "stages": stages, "output_bytes": sizes, "peak_rss_mb": peak_rss_mb()}
+
+def run_batch_case(workdir: Path, fmt: str, mp: float, pairs: int, workers: int) -> Dict[str, Any]:
+    """Whole-batch throughput: ``pairs`` copies of one pair through the batch engine."""
+    from .batch import BatchSettings, PairJob, export_pair, run_parallel_batch
+    from .logic import CropParams
+    heic_available()
+    b = ensure_image(workdir, fmt, mp, "before"); a = ensure_image(workdir, fmt, mp, "after")
+    settings = BatchSettings(CropParams(False, 0, 0), CropParams(False, 0, 0))
+    with tempfile.TemporaryDirectory() as out:
+        jobs = [PairJob(b, a, f"p{i}", Path(out) / f"p{i}.pdf") for i in range(pairs)]
+        t = time.perf_counter()
+        results = ([export_pair(j, settings) for j in jobs] if workers == 1
+                   else list(run_parallel_batch(jobs, settings, workers=workers)))
+        elapsed = time.perf_counter() - t
+    return {"pairs": pairs, "workers": workers, "elapsed": elapsed, "pairs_per_s": pairs / elapsed,
+            "failed": sum(not r.ok for r in results), "peak_rss_mb": peak_rss_mb(),
+            "workers_peak_rss_mb": peak_rss_mb(children=True)}  # with workers > 1 the decoding happens there
+
+def run_lifecycle_case(workdir: Path, mp: float, pairs: int, single_pdf: bool) -> Dict[str, Any]:
+    """``pairs`` exports of one cropped multi-page TIFF pair in this process, sampling after every pair."""
+    from .batch import BatchSettings, PairJob, export_book, export_pair
+    from .logic import CropParams
+    b = ensure_multipage_tiff(workdir, mp, "before"); a = ensure_multipage_tiff(workdir, mp, "after")
+    h = mp_size(mp)[1]
+    crop = CropParams(True, int(h * 0.8), int(h * 0.6))
+    # Every output kind, so the canvas and thumbnail paths are covered too.
+    settings = BatchSettings(crop, crop, extra_outputs=() if single_pdf else ("JPEG", "THUMB"),
+                             pdf_dpi=150, pdf_image_format="jpeg")
+    rss: List[float] = []; files: List[Optional[int]] = []; failed = 0
+    with tempfile.TemporaryDirectory() as out:
+        jobs = (PairJob(b, a, f"p{i}", Path(out) / f"p{i}.pdf") for i in range(pairs))
+        results = (export_book(jobs, settings, Path(out) / "book.pdf") if single_pdf
+                   else (export_pair(j, settings) for j in jobs))
+        for r in results:
+            failed += not r.ok
+            if not single_pdf:
+                for f in [r.output, *r.extra_outputs]:
+                    if f: f.unlink(missing_ok=True)  # keeps disk use flat over a long run
+            rss.append(peak_rss_mb() or 0.0); files.append(open_files())
+    half = max(1, len(rss) // 2)
+    rss_growth = rss[-1] - rss[half - 1]
+    fd_growth = (max(files[half:]) - max(files[:half])) if files[0] is not None and len(files) > 1 else 0
+    return {"pairs": pairs, "failed": failed, "peak_rss_mb": rss[-1], "rss_growth_mb": rss_growth,
+            "open_files": files[-1], "open_files_growth": fd_growth,
+            "leaking": failed > 0 or rss_growth > RSS_SLACK_MB or fd_growth > 0}
+
+def run_lifecycle(workdir: Path, mp: float, pairs: int, log: Callable[[str], None] = print) -> Dict[str, Any]:
+    workdir.mkdir(parents=True, exist_ok=True)
+    results: Dict[str, Any] = {}
+    for name, single in (("pairs", False), ("single_pdf", True)):
+        r = _in_child(run_lifecycle_case, workdir, mp, pairs, single)
+        results[name] = r
+        log(f"lifecycle {name}: {pairs} pairs, peak {_mb(r['peak_rss_mb'])} (+{r['rss_growth_mb']:.0f} MB in the second half), "
+            f"open files {r['open_files']} ({r['open_files_growth']:+d}), failed {r['failed']}"
+            + ("  LEAK" if r["leaking"] else ""))
+    return results
+
+def _time_process(args: List[str], env: Optional[Dict[str, str]] = None, marker: Optional[str] = None) -> Optional[float]:
+    """Seconds until the process exits, or until it prints ``marker``. None if it failed."""
+    t = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, *args], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env, text=True)
+    elapsed = None
+    assert proc.stdout is not None
+    for line in proc.stdout:
+        if marker and marker in line:
+            elapsed = time.perf_counter() - t
+    code = proc.wait()
+    if marker is None and code == 0:
+        elapsed = time.perf_counter() - t
+    return elapsed
+
+def run_startup(repeat: int, log: Callable[[str], None] = print) -> Dict[str, Any]:
+    env = {**os.environ, STARTUP_PROBE_ENV: "1"}
+    if sys.platform.startswith("linux") and not (env.get("DISPLAY") or env.get("WAYLAND_DISPLAY")):
+        env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    probes = {
+        "cli_help": (["-m", "ortho_baa.cli", "--help"], None, None),
+        "batch_help": (["-m", "ortho_baa.cli", "batch", "--help"], None, None),
+        "gui_window": (["-m", "ortho_baa.cli"], env, STARTUP_PROBE_ENV),
+    }
+    stages: Dict[str, Dict[str, float]] = {}
+    for name, (args, penv, marker) in probes.items():
+        times = [t for t in (_time_process(args, penv, marker) for _ in range(repeat)) if t is not None]
+        if not times:
+            log(f"startup {name}: failed"); continue
+        stages[name] = {"median": statistics.median(times), "min": min(times)}
+        log(f"startup {name}: {stages[name]['median']:.3f}s")
+    return {"stages": stages}
+
+def _in_child(fn: Callable[..., Dict[str, Any]], *args) -> Dict[str, Any]:
+    # spawn, not fork: a forked child would start with the parent's peak RSS.
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as ex:
+        return ex.submit(fn, *args).result()
+
+def run(workdir: Path, formats: List[str], sizes: List[float], repeat: int, batch_pairs: int,
+        batch_workers: List[int], log: Callable[[str], None] = print) -> Dict[str, Any]:
+    import PIL
+    results: Dict[str, Any] = {
+        "meta": {"python": platform.python_version(), "pillow": PIL.__version__, "platform": platform.platform(),
+                 "cpus": os.cpu_count(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "repeat": repeat},
+        "cases": {}, "batch": {},
+    }
+    workdir.mkdir(parents=True, exist_ok=True)
+    for fmt in formats:
+        for mp in sizes:
+            name = f"{fmt}-{mp:g}mp"
+            log(f"{name}: preparing")
+            before = ensure_image(workdir, fmt, mp, "before"); after = ensure_image(workdir, fmt, mp, "after")
+            case = _in_child(run_case, before, after, repeat)
+            results["cases"][name] = case
+            log(f"{name}: " + ", ".join(f"{k} {v['median']:.3f}s" for k, v in case["stages"].items())
+                + f", peak {_mb(case['peak_rss_mb'])}")
+    if batch_pairs:
+        mp = 12 if 12 in sizes else sizes[0]
+        fmt = "jpeg" if "jpeg" in formats else formats[0]
+        for workers in batch_workers:
+            name = f"{fmt}-{mp:g}mp-x{batch_pairs}-w{workers}"
+            r = _in_child(run_batch_case, workdir, fmt, mp, batch_pairs, workers)
+            results["batch"][name] = r
+            log(f"batch {name}: {r['pairs_per_s']:.2f} pairs/s, peak {_mb(r['peak_rss_mb'])}"
+                + (f", workers {_mb(r['workers_peak_rss_mb'])}" if workers > 1 else ""))
+    return results
+
+def _batch_peak_mb(r: Dict[str, Any]) -> Optional[float]:
+    peaks = [v for v in (r.get("peak_rss_mb"), r.get("workers_peak_rss_mb")) if v is not None]
+    return max(peaks) if peaks else None
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.10) -> Tuple[List[str], List[str]]:
+    """(report lines, regressions) comparing stage medians, batch throughput and batch peak memory with ``baseline``."""
+    lines: List[str] = []; regressions: List[str] = []
+    for name, case in current.get("cases", {}).items():
+        old = baseline.get("cases", {}).get(name)
+        if not old:
+            continue
+        for stage, t in case["stages"].items():
+            if stage not in old["stages"]:
+                continue
+            before, now = old["stages"][stage]["median"], t["median"]
+            change = (now - before) / before if before else 0.0
+            line = f"{name:<16} {stage:<16} {before:8.3f}s -> {now:8.3f}s  {change:+7.1%}"
+            lines.append(line)
+            if change > threshold and now - before > MIN_DELTA:
+                regressions.append(line)
+    for name, r in current.get("batch", {}).items():
+        old = baseline.get("batch", {}).get(name)
+        if not old:
+            continue
+        change = (old["pairs_per_s"] - r["pairs_per_s"]) / old["pairs_per_s"]  # positive = slower
+        line = f"batch {name:<26} {old['pairs_per_s']:6.2f} -> {r['pairs_per_s']:6.2f} pairs/s  {-change:+7.1%}"
+        lines.append(line)
+        if change > threshold:
+            regressions.append(line)
+        before_mb, now_mb = _batch_peak_mb(old), _batch_peak_mb(r)
+        if before_mb and now_mb is not None:
+            change = (now_mb - before_mb) / before_mb
+            line = f"batch {name:<26} {before_mb:6.0f} -> {now_mb:6.0f} MB peak     {change:+7.1%}"
+            lines.append(line)
+            if change > threshold and now_mb - before_mb > RSS_SLACK_MB:
+                regressions.append(line)
+    return lines, regressions
+
+def _csv(cast):
+    return lambda s: [cast(v) for v in s.split(",") if v]
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m ortho_baa.bench", description="Time load, crop, compose and export on synthetic images.")
+    ap.add_argument("-o", "--out", type=Path, default=Path("bench_results.json"), help="Results file (default: bench_results.json).")
+    ap.add_argument("--baseline", type=Path, help="Earlier results file to compare against; exit code 1 on a regression.")
+    ap.add_argument("--threshold", type=float, default=0.10, help="Slowdown that counts as a regression (default: 0.10 = 10%%).")
+    ap.add_argument("--formats", type=_csv(str), default=list(FORMATS), help="Comma-separated, from: " + ", ".join(FORMATS))
+    ap.add_argument("--sizes", type=_csv(float), default=DEFAULT_SIZES, help="Megapixels, comma-separated (default: 2,12,24,50).")
+    ap.add_argument("--repeat", type=int, default=3, help="Runs per stage; the median is reported (default: 3).")
+    ap.add_argument("--batch-pairs", type=int, default=8, help="Pairs in the throughput run; 0 skips it (default: 8).")
+    ap.add_argument("--batch-workers", type=_csv(int), default=[1, os.cpu_count() or 1], help="Worker counts to run the batch with.")
+    ap.add_argument("--startup", action="store_true", help="Only time process startup (CLI --help, GUI to first window).")
+    ap.add_argument("--lifecycle", action="store_true",
+                    help="Only run a long batch at the smallest --sizes value; exit code 1 if memory or open files grow with it.")
+    ap.add_argument("--lifecycle-pairs", type=int, default=200, help="Pairs in the --lifecycle run (default: 200).")
+    ap.add_argument("--workdir", type=Path, default=Path(tempfile.gettempdir()) / "ortho_baa_bench",
+                    help="Where synthetic images are generated and kept between runs.")
+    args = ap.parse_args(argv)
+
+    log = lambda s: print(s, file=sys.stderr)
+    if args.lifecycle:
+        results = run(args.workdir, [], [], args.repeat, 0, [], log=log)
+        results["lifecycle"] = run_lifecycle(args.workdir, min(args.sizes), args.lifecycle_pairs, log=log)
+        args.out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"wrote {args.out}", file=sys.stderr)
+        return 1 if any(r["leaking"] for r in results["lifecycle"].values()) else 0
+    if args.startup:
+        results = run(args.workdir, [], [], args.repeat, 0, [], log=log)
+        results["cases"]["startup"] = run_startup(max(args.repeat, 5), log=log)
+    else:
+        formats = [f for f in args.formats if f in FORMATS]
+        if "heic" in formats and not heic_available():
+            print("heic: pillow-heif not installed, skipped", file=sys.stderr)
+            formats.remove("heic")
+        results = run(args.workdir, formats, args.sizes, args.repeat, args.batch_pairs, sorted(set(args.batch_workers)), log=log)
+    args.out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print(f"wrote {args.out}", file=sys.stderr)
+    if args.baseline:
+        lines, regressions = compare(results, json.loads(args.baseline.read_text(encoding="utf-8")), args.threshold)
+        print("\n".join(lines))
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}:\n" + "\n".join(regressions))
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+from __future__ import annotations
+import hashlib, os, threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Hashable, Optional, Tuple
+from PIL import ExifTags, Image, UnidentifiedImageError
+
+def image_nbytes(img: Image.Image) -> int:
+    return img.width * img.height * len(img.getbands())
+
+def file_identity(p: Path) -> Tuple[str, int, int]:
+    """(path, size, mtime_ns): changes whenever the file is replaced or edited."""
+    st = os.stat(p)
+    return (str(Path(p).resolve()), st.st_size, st.st_mtime_ns)
+
+class RenderCache:
+    """Thread-safe in-memory LRU for rendered images, capped by total pixel bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key: Hashable, value: Any, nbytes: Optional[int] = None) -> None:
+        if nbytes is None:
+            nbytes = image_nbytes(value)
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            if nbytes > self.max_bytes:
+                return  # would evict everything else and still not fit
+            self._items[key] = (value, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, n) = self._items.popitem(last=False)
+                self._bytes -= n
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+# ---------------- Proxies on disk ----------------
+
+ProxyKey = Tuple[str, int, int, int, int]  # path, size, mtime_ns, EXIF orientation, proxy max side
+
+def proxy_key(p: Path, max_side: int) -> Optional[Tuple[ProxyKey, Tuple[int, int]]]:
+    """(cache key, full frame size) for ``p`` from its header, or None if it can't be read."""
+    from .logic import open_image
+    try:
+        path, size, mtime = file_identity(p)
+        with open_image(p) as im:
+            # A PNG eXIf chunk after the pixel data can only be reached by decoding them; such files count as upright.
+            exif = im.getexif() if im.format != "PNG" or "exif" in im.info else {}
+            orientation = int(exif.get(ExifTags.Base.Orientation, 1))
+            full = im.size
+    except (UnidentifiedImageError, OSError, ValueError, SyntaxError):
+        return None
+    return (path, size, mtime, orientation, max_side), full
+
+class ProxyCache:
+    """Screen-sized proxies of source images on disk, so files seen before show without a decode.
+
+    Proxies are stored as JPEG (PNG when they have alpha) under a hash of their
+    ProxyKey. A hit refreshes the file's mtime, and eviction removes the oldest
+    files once the folder grows past ``max_bytes``, so mtime order is LRU order.
+    """
+
+    def __init__(self, folder: Path, max_bytes: int, quality: int = 90):
+        self.folder, self.max_bytes, self.quality = Path(folder), max_bytes, quality
+        self._bytes: Optional[int] = None  # folder size, counted on the first put
+        self._lock = threading.Lock()
+
+    def _file(self, key: ProxyKey, suffix: str) -> Path:
+        return self.folder / (hashlib.sha1(repr(key).encode("utf-8", "surrogateescape")).hexdigest() + suffix)
+
+    def get(self, key: ProxyKey) -> Optional[Image.Image]:
+        for suffix in (".jpg", ".png"):
+            f = self._file(key, suffix)
+            try:
+                im = Image.open(f)
+                im.load()
+            except FileNotFoundError:
+                continue
+            except (UnidentifiedImageError, OSError):
+                f.unlink(missing_ok=True)  # cut short or corrupted; rebuilt on the next load
+                return None
+            try:
+                os.utime(f)
+            except OSError:
+                pass
+            return im
+        return None
+
+    def put(self, key: ProxyKey, img: Image.Image) -> None:
+        if img.mode not in ("RGB", "L", "RGBA") or self.max_bytes <= 0:
+            return
+        f = self._file(key, ".png" if img.mode == "RGBA" else ".jpg")
+        tmp = f.with_name(f.name + ".tmp")
+        try:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            if img.mode == "RGBA":
+                img.save(tmp, "PNG", compress_level=1)
+            else:
+                img.save(tmp, "JPEG", quality=self.quality, subsampling=0)
+            os.replace(tmp, f)
+            size = f.stat().st_size
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            return  # the cache is only a speed-up
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._folder_bytes()
+            else:
+                self._bytes += size
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        try:
+            with os.scandir(self.folder) as it:
+                return [(e.stat().st_mtime_ns, e.stat().st_size, e.path) for e in it
+                        if e.is_file() and e.name.endswith((".jpg", ".png"))]
+        except OSError:
+            return []
+
+    def _folder_bytes(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self) -> None:
+        # Down to 90% of the cap, so the next few puts don't each rescan the folder.
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path); total -= size
+            except OSError:
+                pass
+        self._bytes = total
+
+    def clear(self) -> None:
+        with self._lock:
+            for _, _, path in self._entries():
+                try: os.remove(path)
+                except OSError: pass
+            self._bytes = 0
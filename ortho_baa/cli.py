@@ -0,0 +1,243 @@
+from __future__ import annotations
+import argparse, json, sys, time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+# Headless entry point. Nothing here (or in the modules it imports) may pull in
+# PySide6; the GUI is only imported when no subcommand is given.
+
+def _crop_arg(s: str) -> Tuple[int, int]:
+    try:
+        top, bottom = (int(v) for v in s.replace(":", ",").split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected TOP,BOTTOM (got {s!r})")
+    if top < 1 or bottom < 1:
+        raise argparse.ArgumentTypeError("crop values must be positive")
+    return top, bottom
+
+def _outputs_arg(s: str) -> Tuple[str, ...]:
+    kinds = tuple(v.strip().upper() for v in s.split(",") if v.strip())
+    bad = [k for k in kinds if k not in ("PDF", "JPEG", "THUMB")]
+    if bad:
+        raise argparse.ArgumentTypeError(f"unknown output {bad[0].lower()!r} (choose from pdf, jpeg, thumb)")
+    return kinds
+
+def _emit(event: dict) -> None:
+    sys.stdout.write(json.dumps(event) + "\n")
+    sys.stdout.flush()
+
+def _add_export_options(p: argparse.ArgumentParser) -> None:
+    p.add_argument("-o", "--out-dir", type=Path, help="Output folder (default: last output folder from the GUI).")
+    p.add_argument("-f", "--format", choices=["pdf", "jpeg"], default=None, help="Output format (default: from config).")
+    p.add_argument("-q", "--quality", type=int, default=92, help="JPEG quality, 1-95 (default: 92).")
+    p.add_argument("--max-kb", type=int, default=None, metavar="KB",
+                   help="Keep JPEG outputs under KB kilobytes, using the highest quality up to --quality that fits; 0 = off (default: from config).")
+    p.add_argument("--progressive", action="store_true", help="Write progressive JPEGs.")
+    p.add_argument("--subsampling", choices=["4:4:4", "4:2:2", "4:2:0"], default=None,
+                   help="JPEG chroma subsampling (default: from config, else the encoder's choice).")
+    p.add_argument("-s", "--scale", type=float, default=None, help="Scale factor inside each half (default: from config).")
+    p.add_argument("--crop", type=_crop_arg, metavar="TOP,BOTTOM", help="Crop both images: keep TOP rows, then the last BOTTOM rows.")
+    p.add_argument("--before-crop", type=_crop_arg, metavar="TOP,BOTTOM", help="Crop for the before image (overrides --crop).")
+    p.add_argument("--after-crop", type=_crop_arg, metavar="TOP,BOTTOM", help="Crop for the after image (overrides --crop).")
+    p.add_argument("--pdf-dpi", type=float, default=None,
+                   help="Resample images to this DPI at their printed size before embedding; 0 = source resolution (default: from config).")
+    p.add_argument("--pdf-images", choices=["flate", "jpeg"], default=None,
+                   help="How images are stored in the PDF: lossless flate or jpeg (default: from config).")
+    p.add_argument("--pdf-quality", type=int, default=None, help="JPEG quality for --pdf-images jpeg (default: from config).")
+    p.add_argument("--reduced-decode", action="store_true",
+                   help="Decode images only at the resolution the output needs (much faster for large JPEG/HEIC).")
+    p.add_argument("--also", type=_outputs_arg, default=None, metavar="KINDS",
+                   help="Also write these, from the same decode: comma-separated pdf, jpeg, thumb (default: from config).")
+    p.add_argument("--thumb-size", type=int, default=None, help="Longest side of the thumb output in px (default: from config).")
+    p.add_argument("--thumb-format", choices=["jpeg", "webp"], default=None, help="Format of the thumb output (default: from config).")
+
+def _settings_from_args(args: argparse.Namespace, cfg: dict, fmt: Optional[str] = None):
+    from .logic import CropParams
+    from .batch import BatchSettings
+
+    fmt = fmt or (args.format or cfg.get("output_format", "PDF")).upper()
+    scale = args.scale if args.scale is not None else float(cfg.get("scale_factor", 0.85))
+
+    def params(specific: Optional[Tuple[int, int]]) -> CropParams:
+        crop = specific or args.crop
+        return CropParams(True, *crop) if crop else CropParams(False, 0, 0)
+
+    reduced = args.reduced_decode or bool(cfg.get("reduced_decode", False))
+    pdf_dpi = args.pdf_dpi if args.pdf_dpi is not None else float(cfg.get("pdf_dpi", 0))
+    return BatchSettings(
+        params(args.before_crop), params(args.after_crop), fmt, scale, args.quality, reduced,
+        pdf_dpi=pdf_dpi or None,
+        pdf_image_format=args.pdf_images or cfg.get("pdf_images", "flate"),
+        pdf_jpeg_quality=args.pdf_quality if args.pdf_quality is not None else int(cfg.get("pdf_jpeg_quality", 90)),
+        extra_outputs=args.also if args.also is not None else tuple(k.upper() for k in cfg.get("extra_outputs", [])),
+        thumb_size=args.thumb_size or int(cfg.get("thumb_size", 800)),
+        thumb_format=(args.thumb_format or cfg.get("thumb_format", "JPEG")).upper(),
+        jpeg_max_kb=args.max_kb if args.max_kb is not None else int(cfg.get("jpeg_max_kb", 0)),
+        jpeg_progressive=args.progressive or bool(cfg.get("jpeg_progressive", False)),
+        jpeg_subsampling=args.subsampling or str(cfg.get("jpeg_subsampling", "")),
+    )
+
+def _pair_event(res, **extra) -> dict:
+    return {"event": "pair", **extra, **res.as_dict()}
+
+def build_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(prog="ortho-baa", description="Before & After PDF/JPEG creator. Run without a command to open the GUI.")
+    ap.add_argument("--trace", nargs="?", const="", metavar="FILE",
+                    help="Append per-stage timing spans as JSON lines to FILE (default: ~/.config/ortho_baa/trace.jsonl).")
+    sub = ap.add_subparsers(dest="command")
+
+    b = sub.add_parser("batch", help="Export every before/after pair in a folder without the GUI.",
+                       description="Export every before/after pair in FOLDER. Progress is printed as JSON lines.")
+    b.add_argument("folder", type=Path)
+    _add_export_options(b)
+    b.add_argument("-r", "--recursive", action="store_true",
+                   help="Include subfolders; their outputs go in matching subfolders of the output folder.")
+    b.add_argument("--rescan", action="store_true", help="Ignore the cached folder listing and list every folder again.")
+    b.add_argument("--single-pdf", type=Path, metavar="FILE",
+                   help="Write all pairs as pages of one PDF (relative paths go in the output folder).")
+    b.add_argument("--no-bookmarks", action="store_true", help="With --single-pdf, don't add a bookmark per patient.")
+    b.add_argument("--force", action="store_true", help="Re-export every pair, even ones the output folder's manifest says are up to date.")
+    b.add_argument("--hash", action="store_true",
+                   help="Record content hashes in the manifest, so touched-but-unchanged inputs are still skipped.")
+    b.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes; 0 = one per CPU, 1 = in-process (default: from config).")
+    b.add_argument("--mem-budget", type=int, default=None, metavar="MB",
+                   help="RAM budget for decoded images across workers; 0 = half of physical RAM (default: from config).")
+
+    w = sub.add_parser("watch", help="Keep running and export pairs as they arrive in a folder.",
+                       description="Watch FOLDER and export each NAME_before/NAME_after pair once both files are fully written. "
+                                   "Results are printed as JSON lines. Stop with Ctrl+C.")
+    w.add_argument("folder", type=Path)
+    _add_export_options(w)
+    w.add_argument("--settle", type=float, default=2.0, help="Seconds a file must stay unchanged before it is used (default: 2).")
+    w.add_argument("--backend", choices=["auto", "inotify", "poll"], default="auto",
+                   help="Change detection: inotify (Linux) or polling (default: inotify when available).")
+    w.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between polls (default: 1).")
+
+    s = sub.add_parser("serve", help="Run a local render service that exports pairs sent to it over HTTP.",
+                       description="Keep the imaging libraries loaded and export pairs posted to http://127.0.0.1:PORT/jobs "
+                                   "on a pool of workers. The export options are the defaults for jobs that don't set them; "
+                                   "relative output paths go in the output folder. Finished jobs are printed as JSON lines.")
+    _add_export_options(s)
+    s.add_argument("-p", "--port", type=int, default=8765, help="Port on 127.0.0.1 (default: 8765).")
+    s.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes; 0 = one per CPU, 1 = in-process (default: from config).")
+    return ap
+
+def run_batch(args: argparse.Namespace) -> int:
+    from .config import load_config
+    from .batch import iter_jobs, export_pair, export_book, run_parallel_batch
+    from .manifest import ExportManifest
+
+    cfg = load_config()
+    folder: Path = args.folder
+    if not folder.is_dir():
+        _emit({"event": "error", "error": f"Not a folder: {folder}"})
+        return 2
+    out_dir = args.out_dir or Path(cfg["last_out_dir"])
+    out_dir.mkdir(parents=True, exist_ok=True)
+    settings = _settings_from_args(args, cfg, fmt="PDF" if args.single_pdf else None)
+    fmt = settings.fmt
+    # The scan runs lazily: the first pairs export while the rest of the tree is still being listed,
+    # so the number of pairs is only known in the "done" event. A single PDF gets its pages in name
+    # order instead, so each folder is listed in full before its pairs start.
+    jobs = iter_jobs(folder, out_dir, fmt, recursive=args.recursive, use_cache=not args.rescan,
+                     ordered=bool(args.single_pdf))
+    # The manifest tracks per-pair outputs; a single PDF is always rewritten as a whole.
+    manifest = None if args.single_pdf else ExportManifest(out_dir, hash_contents=args.hash)
+    skipped: List = []
+    if manifest is not None and not args.force:
+        jobs = manifest.iter_pending(jobs, settings, skipped)
+    _emit({"event": "start", "folder": str(folder), "out_dir": str(out_dir), "format": fmt, "recursive": args.recursive})
+
+    workers = args.jobs if args.jobs is not None else int(cfg.get("batch_workers", 1))
+    budget_mb = args.mem_budget if args.mem_budget is not None else int(cfg.get("batch_mem_budget_mb", 0))
+    if args.single_pdf:
+        book_path = out_dir / args.single_pdf.with_suffix(".pdf")
+        results = export_book(jobs, settings, book_path, bookmarks=not args.no_bookmarks)
+    elif workers == 1:
+        results = (export_pair(job, settings) for job in jobs)
+    else:
+        results = run_parallel_batch(jobs, settings, workers=workers or None, mem_budget=budget_mb * 1024 ** 2 or None)
+
+    started = time.perf_counter(); failed = warned = 0; count = 0
+    for count, res in enumerate(results, start=1):
+        failed += not res.ok; warned += bool(res.warning)
+        if manifest is not None:
+            manifest.record(res, settings)
+        _emit(_pair_event(res, index=count, elapsed=round(time.perf_counter() - started, 4)))
+    _emit({"event": "done", "pairs": count, "ok": count - failed, "failed": failed, "warnings": warned, "skipped": len(skipped),
+           "elapsed": round(time.perf_counter() - started, 4)})
+    return 1 if failed else 0
+
+def run_watch(args: argparse.Namespace) -> int:
+    from .config import load_config
+    from .manifest import ExportManifest
+    from .watch import FolderWatcher
+
+    cfg = load_config()
+    folder: Path = args.folder
+    if not folder.is_dir():
+        _emit({"event": "error", "error": f"Not a folder: {folder}"})
+        return 2
+    out_dir = args.out_dir or Path(cfg["last_out_dir"])
+    out_dir.mkdir(parents=True, exist_ok=True)
+    settings = _settings_from_args(args, cfg)
+    watcher = FolderWatcher(folder, out_dir, settings, settle=args.settle, poll_interval=args.poll_interval,
+                            backend=args.backend, manifest=ExportManifest(out_dir),
+                            on_result=lambda res: _emit(_pair_event(res, time=round(time.time(), 3))))
+    _emit({"event": "watching", "folder": str(folder), "out_dir": str(out_dir), "format": settings.fmt})
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    _emit({"event": "stopped"})
+    return 0
+
+def run_serve(args: argparse.Namespace) -> int:
+    from .config import load_config
+    from .daemon import RenderServer, RenderService
+
+    cfg = load_config()
+    out_dir = args.out_dir or Path(cfg["last_out_dir"])
+    settings = _settings_from_args(args, cfg)
+    workers = args.jobs if args.jobs is not None else int(cfg.get("batch_workers", 1))
+    service = RenderService(settings, out_dir, workers=workers or None,
+                            on_result=lambda job_id, res: _emit(_pair_event(res, id=job_id, time=round(time.time(), 3))))
+    try:
+        server = RenderServer(service, args.port)
+    except OSError as e:
+        service.close()
+        _emit({"event": "error", "error": f"Could not listen on port {args.port}: {e.strerror or e}"})
+        return 2
+    _emit({"event": "listening", "url": server.url, "workers": service.workers, "out_dir": str(out_dir)})
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    _emit({"event": "stopped"})
+    return 0
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command in ("batch", "watch", "serve"):
+        # Same sources as the GUI: --trace, then $ORTHO_BAA_TRACE, then the trace_log config key.
+        from .config import load_config
+        from .trace import install_log_sink
+        install_log_sink(load_config(), path=args.trace)
+    elif args.trace is not None:
+        from .trace import install_log_sink
+        install_log_sink(path=args.trace)
+    if args.command == "batch":
+        return run_batch(args)
+    if args.command == "watch":
+        return run_watch(args)
+    if args.command == "serve":
+        return run_serve(args)
+    from .main import run_app
+    run_app()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
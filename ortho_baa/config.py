@@ -1,11 +1,13 @@
 from __future__ import annotations
-import json
+import json, os
 from pathlib import Path
 from typing import Any, Dict
 
 APP_DIR = Path.home() / ".config" / "ortho_baa"
-APP_DIR.mkdir(parents=True, exist_ok=True)
 CFG_PATH = APP_DIR / "config.json"
+# Disposable data (indexes, thumbnails) goes in the XDG cache dir rather than next to the config.
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME") or (Path.home() / ".cache")) / "ortho_baa"
+STARTUP_PROBE_ENV = "ORTHO_BAA_STARTUP_PROBE"  # set: the GUI prints this once its window is up, then quits
 
 DEFAULTS: Dict[str, Any] = {
     "last_out_dir": str((Path.home() / "Documents" / "IPA Fixer" / "Before and After")),
@@ -13,6 +15,23 @@ DEFAULTS: Dict[str, Any] = {
     "crop_defaults": {"top": 3250, "bottom": 3020},
     "output_format": "PDF",
     "name_parts": {"use_id": True, "use_first": True, "use_last": True},
+    "pdf_dpi": 0,                # 0 = embed images at source resolution
+    "pdf_images": "flate",       # "flate" (lossless) or "jpeg"
+    "pdf_jpeg_quality": 90,
+    "render_cache_mb": 512,      # in-memory cache shared by Preview and Save
+    "proxy_cache_mb": 256,       # on-disk screen-sized copies of dropped images; 0 = off
+    "reduced_decode": False,     # batch: decode at output resolution only
+    "batch_single_pdf": False,   # batch into one multi-page PDF
+    "batch_skip_unchanged": True,  # skip pairs the output folder's manifest says are up to date
+    "batch_workers": 0,          # 0 = one process per CPU
+    "batch_mem_budget_mb": 0,    # 0 = half of physical RAM
+    "extra_outputs": [],         # also write these next to each export: "PDF", "JPEG", "THUMB"
+    "thumb_size": 800,           # longest side of the THUMB output, px
+    "thumb_format": "JPEG",      # "JPEG" or "WEBP"
+    "jpeg_max_kb": 0,            # > 0: lower JPEG quality until the file fits in this many KB
+    "jpeg_progressive": False,
+    "jpeg_subsampling": "",      # "4:4:4", "4:2:2", "4:2:0"; "" = encoder default
+    "trace_log": False,          # append stage timings to trace.jsonl next to this file
 }
 
 def load_config() -> Dict[str, Any]:
@@ -33,6 +52,7 @@ def load_config() -> Dict[str, Any]:
 
 def save_config(cfg: Dict[str, Any]) -> None:
     try:
+        CFG_PATH.parent.mkdir(parents=True, exist_ok=True)  # on first save, not at import
         CFG_PATH.write_text(json.dumps(cfg, indent=2))
     except Exception:
         pass
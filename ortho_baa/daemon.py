@@ -0,0 +1,349 @@
+from __future__ import annotations
+import importlib, json, os, threading, time, uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from dataclasses import asdict, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Optional, Tuple, Union
+from urllib import error as urlerror, parse, request as urlrequest
+from .logic import CropParams
+from .batch import BatchSettings, PairJob, PairResult, export_pair
+from .exporters import OUTPUT_KINDS
+from . import trace
+
+# Render service: a long-lived process that keeps Pillow, reportlab and the HEIF
+# opener loaded and exports pairs sent to it over HTTP on localhost, so callers
+# that render one pair at a time don't pay for interpreter start-up and imports
+# on every call.
+#
+#     POST /jobs          {"before": ..., "after": ..., "out": ..., "wait": true}
+#     GET  /jobs/<id>     job state; ?wait=SECONDS blocks until it has finished
+#     GET  /status        queue depth, throughput and totals
+#
+# There is no authentication: the server only listens on 127.0.0.1. So that web
+# pages open in a browser can't drive it, requests must name a loopback Host
+# (and Origin, if sent), POST bodies must be application/json (not a "simple"
+# cross-origin request), and outputs can only be written below the output folder.
+
+HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_URL = f"http://{HOST}:{DEFAULT_PORT}"
+THROUGHPUT_WINDOW = 60.0  # seconds of finished jobs counted in /status
+KEEP_FINISHED = 10000  # finished jobs kept for GET /jobs/<id>
+SUFFIX_FORMAT = {".pdf": "PDF", ".jpg": "JPEG", ".jpeg": "JPEG"}
+LOOPBACK_NAMES = ("127.0.0.1", "localhost", "::1")
+
+def warm_up(trace_logs: Tuple[Path, ...] = ()) -> None:
+    """Import and register everything an export needs, once per worker; spawned workers also reopen the trace logs."""
+    trace.install_worker_sinks(list(trace_logs))
+    from PIL import Image
+    from .logic import ensure_heif_opener
+    from .exporters import pdf_image
+    Image.init()
+    ensure_heif_opener()
+    pdf_image(Image.new("RGB", (1, 1)), 1, 1)  # the PDF path's own lazy reportlab imports and settings
+    importlib.import_module("reportlab.pdfgen.canvas")  # export_pdf imports this itself, not pdf_image
+
+def _crop(value: Any) -> CropParams:
+    if value is None:
+        return CropParams(False, 0, 0)
+    if isinstance(value, dict):
+        return CropParams(bool(value.get("enabled", True)), int(value["top"]), int(value["bottom"]))
+    top, bottom = (int(v) for v in value)
+    return CropParams(True, top, bottom)
+
+def _outputs(value: Any) -> Tuple[str, ...]:
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise ValueError("also must be a list of output kinds")
+    kinds = tuple(v.upper() for v in value)
+    bad = [k for k in kinds if k not in OUTPUT_KINDS]
+    if bad:
+        raise ValueError(f"unknown output {bad[0].lower()!r} (choose from {', '.join(k.lower() for k in OUTPUT_KINDS)})")
+    return kinds
+
+def parse_job(body: Dict[str, Any], base: BatchSettings, out_dir: Path) -> Tuple[PairJob, BatchSettings]:
+    """A job from a request body; fields it leaves out come from ``base``. Raises ValueError on bad input."""
+    try:
+        before, after = Path(body["before"]), Path(body["after"])
+        out = Path(body["out"])
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"missing or invalid field: {e}")
+    if not (before.is_absolute() and after.is_absolute()):
+        raise ValueError("before and after must be absolute paths")
+    root = Path(os.path.realpath(out_dir))
+    out = Path(os.path.realpath(out if out.is_absolute() else root / out))
+    if out == root or not out.is_relative_to(root):
+        raise ValueError(f"out must be inside the output folder {root}")
+    fmt = str(body.get("format") or SUFFIX_FORMAT.get(out.suffix.lower(), base.fmt)).upper()
+    if fmt not in ("PDF", "JPEG"):
+        raise ValueError(f"unknown format {fmt.lower()!r}")
+    try:
+        crop = body.get("crop")
+        settings = replace(
+            base, fmt=fmt,
+            before_crop=_crop(body.get("before_crop", crop)) if "before_crop" in body or "crop" in body else base.before_crop,
+            after_crop=_crop(body.get("after_crop", crop)) if "after_crop" in body or "crop" in body else base.after_crop,
+            scale_factor=float(body.get("scale", base.scale_factor)),
+            quality=int(body.get("quality", base.quality)),
+            jpeg_max_kb=int(body.get("max_kb", base.jpeg_max_kb)),
+            extra_outputs=_outputs(body["also"]) if "also" in body else base.extra_outputs)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"invalid settings: {e}")
+    stem = str(body.get("stem") or out.stem)
+    return PairJob(before, after, stem, out), settings
+
+class RenderService:
+    """The job queue behind the HTTP server: a warm worker pool plus bookkeeping for /status."""
+
+    def __init__(self, settings: BatchSettings, out_dir: Path, workers: Optional[int] = None,
+                 on_result: Optional[Callable[[str, PairResult], None]] = None):
+        self.settings, self.out_dir, self.on_result = settings, out_dir, on_result
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self._pool = self._start_pool()
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._futures: Dict[str, Future] = {}
+        self._done: Dict[str, threading.Event] = {}  # set once the result is recorded
+        self._recent: Deque[Tuple[float, float]] = deque()  # (finished at, seconds) within THROUGHPUT_WINDOW
+        self.started = time.time()
+        self.completed = self.failed = 0
+
+    def _start_pool(self) -> Executor:
+        # One worker runs in-process, like `batch --jobs 1`; more get their own processes.
+        if self.workers == 1:
+            warm_up()
+            return ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up, initargs=(tuple(trace.log_paths()),),
+                                   mp_context=get_context("spawn"))
+        for fut in [pool.submit(os.getpid) for _ in range(self.workers)]:
+            fut.result()  # start the workers now rather than on the first job
+        return pool
+
+    def _restart_pool(self, broken: Executor) -> None:
+        """Replace a pool that lost a worker (e.g. to the OOM killer); its other jobs fail with it."""
+        with self._lock:
+            if self._pool is not broken:
+                return  # another thread got there first
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._start_pool()
+
+    def submit(self, body: Dict[str, Any]) -> str:
+        """Queue a job; raises ValueError for a bad body and BrokenProcessPool if no worker can be started."""
+        job, settings = parse_job(body, self.settings, self.out_dir)
+        job_id = uuid.uuid4().hex[:12]
+        for retry in (True, False):
+            pool = self._pool
+            try:
+                fut = pool.submit(export_pair, job, settings)
+                break
+            except BrokenProcessPool:
+                if not retry:
+                    raise
+                self._restart_pool(pool)
+        with self._lock:
+            self._jobs[job_id] = {"id": job_id, "status": "queued", "stem": job.stem, "submitted": round(time.time(), 3)}
+            self._done[job_id] = threading.Event()
+            self._futures[job_id] = fut
+        submitted = time.monotonic()
+        fut.add_done_callback(lambda f: self._finished(job_id, job, f, submitted))
+        return job_id
+
+    def _finished(self, job_id: str, job: PairJob, fut: Future, submitted: float) -> None:
+        crashed = False
+        try:
+            res = fut.result()
+        except Exception as e:  # worker died
+            res = PairResult(job, False, error=f"{type(e).__name__}: {e}")
+            crashed = True
+        now = time.monotonic()
+        with self._lock:
+            self._futures.pop(job_id, None)
+            self._jobs[job_id] = {**self._jobs.get(job_id, {}), **res.as_dict(), "status": "done" if res.ok else "failed",
+                                  "seconds": round(now - submitted, 4), **({"worker_died": True} if crashed else {})}
+            self._recent.append((now, now - submitted))
+            self.completed += res.ok; self.failed += not res.ok
+            while len(self._jobs) > KEEP_FINISHED + len(self._futures):
+                oldest = next(k for k in self._jobs if k not in self._futures)
+                del self._jobs[oldest]
+            self._done.pop(job_id).set()
+        if self.on_result:
+            self.on_result(job_id, res)
+
+    def job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            rec = self._jobs.get(job_id)
+            fut = self._futures.get(job_id)
+            if rec is not None and fut is not None and fut.running():
+                rec = {**rec, "status": "running"}
+            return dict(rec) if rec is not None else None
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """The job once it has finished, or as it stands after ``timeout`` seconds."""
+        with self._lock:
+            done = self._done.get(job_id)
+        if done is not None:
+            done.wait(timeout)
+        return self.job(job_id)
+
+    def status(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and now - self._recent[0][0] > THROUGHPUT_WINDOW:
+                self._recent.popleft()
+            # A process pool marks a few more jobs running than it has workers (they sit in its call queue).
+            running = min(self.workers, sum(f.running() for f in self._futures.values()))
+            recent = [secs for _, secs in self._recent]
+            return {
+                "workers": self.workers, "queued": len(self._futures) - running, "running": running,
+                "completed": self.completed, "failed": self.failed,
+                "uptime": round(time.time() - self.started, 1),
+                "per_minute": round(len(recent) * 60.0 / min(THROUGHPUT_WINDOW, max(1e-9, time.time() - self.started)), 2),
+                "mean_seconds": round(sum(recent) / len(recent), 4) if recent else None,
+            }
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "RenderServer"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass  # results are reported through RenderService.on_result
+
+    def _reply(self, code: int, data: Dict[str, Any]) -> None:
+        payload = json.dumps(data).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _refuse_remote(self) -> bool:
+        """Reply 403 unless Host (and Origin, if any) name the loopback address; True if refused."""
+        def loopback(netloc: str) -> bool:
+            try:
+                return (parse.urlsplit("//" + netloc).hostname or "") in LOOPBACK_NAMES
+            except ValueError:
+                return False
+        origin = self.headers.get("Origin")
+        if not loopback(self.headers.get("Host", "")) or (origin is not None and not loopback(parse.urlsplit(origin).netloc)):
+            self._reply(403, {"error": "only local clients may use the render service"})
+            return True
+        return False
+
+    def do_GET(self) -> None:
+        if self._refuse_remote():
+            return
+        url = parse.urlsplit(self.path)
+        service = self.server.service
+        if url.path == "/status":
+            return self._reply(200, service.status())
+        if url.path.startswith("/jobs/"):
+            query = parse.parse_qs(url.query)
+            try:
+                wait = float(query["wait"][0]) if "wait" in query else None
+            except ValueError:
+                return self._reply(400, {"error": "wait must be a number of seconds"})
+            job_id = url.path[len("/jobs/"):]
+            rec = service.wait(job_id, wait) if wait else service.job(job_id)
+            return self._reply(200, rec) if rec is not None else self._reply(404, {"error": f"no job {job_id}"})
+        self._reply(404, {"error": f"not found: {url.path}"})
+
+    def do_POST(self) -> None:
+        if self._refuse_remote():
+            return
+        if parse.urlsplit(self.path).path != "/jobs":
+            return self._reply(404, {"error": f"not found: {self.path}"})
+        if self.headers.get_content_type() != "application/json":
+            return self._reply(415, {"error": "Content-Type must be application/json"})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            if not isinstance(body, dict):
+                raise ValueError("expected a JSON object")
+            job_id = self.server.service.submit(body)
+        except ValueError as e:
+            return self._reply(400, {"error": str(e)})
+        except BrokenProcessPool as e:
+            return self._reply(503, {"error": f"render workers unavailable: {e}"})
+        if body.get("wait"):
+            rec = self.server.service.wait(job_id) or {"id": job_id}
+            return self._reply(500 if rec.get("worker_died") else 200, rec)
+        self._reply(202, {"id": job_id, "status": "queued"})
+
+class RenderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service: RenderService, port: int = DEFAULT_PORT):
+        super().__init__((HOST, port), _Handler)
+        self.service = service
+
+    @property
+    def url(self) -> str:
+        return f"http://{HOST}:{self.server_address[1]}"
+
+# ---------------- Client ----------------
+
+class RenderError(Exception):
+    """The service refused a request (bad job) or could not be reached."""
+
+CropArg = Union[CropParams, Tuple[int, int], None]
+
+class RenderClient:
+    """Talks to a running ``ortho-baa serve``.
+
+        client = RenderClient()
+        res = client.render(before, after, out_dir / "X_BeforeAndAfter.pdf", crop=(3250, 3020))
+        if res["status"] != "done": ...
+    """
+
+    def __init__(self, url: str = DEFAULT_URL, timeout: Optional[float] = None):
+        self.url, self.timeout = url.rstrip("/"), timeout
+
+    def _call(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        req = urlrequest.Request(self.url + path, data=data, method=method, headers={"Content-Type": "application/json"})
+        try:
+            with urlrequest.urlopen(req, timeout=self.timeout) as resp:
+                return json.loads(resp.read())
+        except urlerror.HTTPError as e:
+            try:
+                msg = json.loads(e.read()).get("error", e.reason)
+            except ValueError:
+                msg = e.reason
+            raise RenderError(f"{e.code}: {msg}") from None
+        except urlerror.URLError as e:
+            raise RenderError(f"render service not reachable at {self.url}: {e.reason}") from None
+
+    @staticmethod
+    def _crop(crop: CropArg) -> Any:
+        if crop is None:
+            return None
+        return asdict(crop) if isinstance(crop, CropParams) else list(crop)
+
+    def submit(self, before: Path, after: Path, out: Path, crop: CropArg = None, before_crop: CropArg = None,
+               after_crop: CropArg = None, scale: Optional[float] = None, fmt: Optional[str] = None,
+               quality: Optional[int] = None, max_kb: Optional[int] = None, also: Optional[Tuple[str, ...]] = None,
+               wait: bool = False) -> Dict[str, Any]:
+        """Queue a pair. Settings left as None use the service's defaults; ``out`` must be in its output folder
+        (relative paths are taken from there)."""
+        body: Dict[str, Any] = {"before": os.path.abspath(before), "after": os.path.abspath(after), "out": str(out), "wait": wait}
+        for key, value in (("crop", self._crop(crop)), ("before_crop", self._crop(before_crop)),
+                           ("after_crop", self._crop(after_crop)), ("scale", scale), ("format", fmt),
+                           ("quality", quality), ("max_kb", max_kb), ("also", list(also) if also is not None else None)):
+            if value is not None:
+                body[key] = value
+        return self._call("POST", "/jobs", body)
+
+    def render(self, before: Path, after: Path, out: Path, **options: Any) -> Dict[str, Any]:
+        """Export one pair and wait for it; the result has ``status`` "done" or "failed", ``output`` and ``error``."""
+        return self.submit(before, after, out, wait=True, **options)
+
+    def job(self, job_id: str, wait: Optional[float] = None) -> Dict[str, Any]:
+        """State of a submitted job; with ``wait``, block up to that many seconds for it to finish."""
+        return self._call("GET", f"/jobs/{job_id}" + (f"?wait={wait}" if wait else ""))
+
+    def status(self) -> Dict[str, Any]:
+        return self._call("GET", "/status")
@@ -1,17 +1,82 @@
 from __future__ import annotations
+import math, zlib
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from pathlib import Path
-from PIL import Image
-from reportlab.lib.pagesizes import landscape, letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-from .utils import fit_rect
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Sequence
+from PIL import Image, UnidentifiedImageError
+from .utils import fit_rect, to_rgb, resize_rgb
+from .logic import prepare_tile
+from . import trace
 
-LETTER_LANDSCAPE = landscape(letter)
+if TYPE_CHECKING:
+    from reportlab.lib.utils import ImageReader
+
+LETTER_LANDSCAPE = (792.0, 612.0)  # reportlab's landscape(letter), in points
 MARGIN = 24
 HALF_W = (LETTER_LANDSCAPE[0] - (MARGIN * 2)) / 2
 DRAW_H = LETTER_LANDSCAPE[1] - (MARGIN * 2)
+CANVAS_PX = (3300, 2550)  # 11x8.5" at ~300dpi-ish landscape canvas
+CANVAS_MARGIN_PX = 90
+
+def half_target_px(scale_factor: float = 0.85) -> tuple[float, float]:
+    """Largest size (px) either image is drawn at on the composed canvas."""
+    half_w = (CANVAS_PX[0] - (CANVAS_MARGIN_PX * 2)) // 2
+    draw_h = CANVAS_PX[1] - (CANVAS_MARGIN_PX * 2)
+    return (half_w * scale_factor, draw_h * scale_factor)
+
+def _reportlab() -> None:
+    # reportlab is imported on the first PDF export; it adds ~50 ms to startup otherwise.
+    # Write image streams as binary. The ASCII85 default inflates them by 25% and,
+    # without the optional rl_accel extension, encodes them in pure Python.
+    from reportlab import rl_config
+    rl_config.useA85 = 0
+
+PDF_IMAGE_FORMATS = ("flate", "jpeg")
+PASSTHROUGH_SLACK = 1.25  # embed an untouched JPEG as-is when it is at most this much above the target DPI
+
+def _untouched_jpeg(img: Image.Image) -> Optional[str]:
+    """Path of the JPEG file ``img`` was decoded from, if its pixels are exactly that file's."""
+    fn = getattr(img, "filename", None)
+    if getattr(img, "format", None) != "JPEG" or not fn or img.mode not in ("RGB", "L"):
+        return None
+    try:
+        with Image.open(fn) as src:  # header only; rules out draft-mode (reduced) decodes
+            return fn if src.size == img.size else None
+    except (UnidentifiedImageError, OSError):
+        return None
+
+def pdf_image(img: Image.Image, box_w: float, box_h: float, dpi: Optional[float] = None,
+              image_format: str = "flate", jpeg_quality: int = 90) -> ImageReader:
+    """ImageReader for drawing ``img`` into a box_w x box_h pt box.
 
-def export_pdf(out_path: Path, before: Image.Image, after: Image.Image, scale_factor: float = 0.85) -> Path:
+    With ``dpi``, the image is first resampled to the printed size. ``image_format``
+    picks lossless Flate or DCT (JPEG) streams. Untouched JPEG sources that already
+    fit are embedded byte-for-byte.
+    """
+    _reportlab()
+    from reportlab.lib.utils import ImageReader
+    target = (max(1, math.ceil(box_w / 72 * dpi)), max(1, math.ceil(box_h / 72 * dpi))) if dpi else None
+    src = _untouched_jpeg(img)
+    if src and (target is None or img.width <= target[0] * PASSTHROUGH_SLACK):
+        return ImageReader(src)
+    if target and img.width > target[0]:
+        with trace.span("resample"):
+            rgb = resize_rgb(img, target)
+    else:
+        rgb = img if img.mode in ("RGB", "L") else to_rgb(img)  # reportlab embeds L as DeviceGray
+    if image_format == "jpeg":
+        buf = BytesIO()
+        with trace.span("pdf.encode", images="jpeg"):
+            rgb.save(buf, "JPEG", quality=jpeg_quality)
+        buf.seek(0)
+        return ImageReader(buf)
+    return ImageReader(rgb)
+
+def export_pdf(out_path: Path, before: Image.Image, after: Image.Image, scale_factor: float = 0.85,
+               dpi: Optional[float] = None, image_format: str = "flate", jpeg_quality: int = 90) -> Path:
+    _reportlab()
+    from reportlab.pdfgen import canvas
     c = canvas.Canvas(str(out_path), pagesize=LETTER_LANDSCAPE)
     bw, bh = before.size
     fit_bw, fit_bh = fit_rect(bw, bh, HALF_W, DRAW_H)
@@ -21,38 +86,295 @@ def export_pdf(out_path: Path, before: Image.Image, after: Image.Image, scale_fa
     fit_aw, fit_ah = fit_rect(aw, ah, HALF_W, DRAW_H)
     fit_aw *= scale_factor; fit_ah *= scale_factor
     ax = MARGIN + HALF_W + (HALF_W - fit_aw) / 2; ay = MARGIN + (DRAW_H - fit_ah) / 2
-    c.drawImage(ImageReader(before.convert('RGB')), bx, by, width=fit_bw, height=fit_bh, preserveAspectRatio=True)
-    c.drawImage(ImageReader(after.convert('RGB')),  ax, ay, width=fit_aw, height=fit_ah, preserveAspectRatio=True)
-    c.showPage(); c.save(); return out_path
+    with trace.span("pdf.encode"):  # reportlab compresses image data as it is drawn
+        c.drawImage(pdf_image(before, fit_bw, fit_bh, dpi, image_format, jpeg_quality), bx, by, width=fit_bw, height=fit_bh, preserveAspectRatio=True)
+        c.drawImage(pdf_image(after, fit_aw, fit_ah, dpi, image_format, jpeg_quality),  ax, ay, width=fit_aw, height=fit_ah, preserveAspectRatio=True)
+    with trace.span("pdf.write", file=Path(out_path).name):
+        c.showPage(); c.save()
+    return out_path
+
+def canvas_size_within(max_w: int, max_h: int) -> tuple[int, int]:
+    """Size of the composed canvas scaled down to fit a max_w x max_h box."""
+    w, h = fit_rect(CANVAS_PX[0], CANVAS_PX[1], max_w, max_h)
+    return (max(1, int(min(w, CANVAS_PX[0]))), max(1, int(min(h, CANVAS_PX[1]))))
 
-def compose_preview_image(before: Image.Image, after: Image.Image, scale_factor: float = 0.85) -> Image.Image:
-    target_w, target_h = (3300, 2550)  # 11x8.5" at ~300dpi-ish landscape canvas
-    margin = 90
+def compose_preview_image(before: Image.Image, after: Image.Image, scale_factor: float = 0.85,
+                          size: tuple[int, int] = CANVAS_PX, reducing_gap: float | None = None) -> Image.Image:
+    with trace.span("compose", size=size):
+        return _compose(before, after, scale_factor, size, reducing_gap)
+
+def _compose(before: Image.Image, after: Image.Image, scale_factor: float, size: tuple[int, int],
+             reducing_gap: float | None) -> Image.Image:
+    target_w, target_h = size
+    margin = round(CANVAS_MARGIN_PX * target_w / CANVAS_PX[0])
     half_w = (target_w - (margin * 2)) // 2
     draw_h = target_h - (margin * 2)
     canvas_img = Image.new('RGB', (target_w, target_h), (255, 255, 255))
 
-    def fit(w, h, bw, bh):
-        from .utils import fit_rect
-        fw, fh = fit_rect(w, h, bw, bh)
-        return int(fw * scale_factor), int(fh * scale_factor)
-
-    bw, bh = before.size
-    fw, fh = fit(bw, bh, half_w, draw_h)
+    tile = prepare_tile(before, None, (half_w, draw_h), scale_factor, reducing_gap)
+    fw, fh = tile.size
     bx = margin + (half_w - fw) // 2
     by = margin + (draw_h - fh) // 2
-    canvas_img.paste(before.convert('RGB').resize((fw, fh), Image.LANCZOS), (bx, by))
+    canvas_img.paste(tile, (bx, by))
 
-    aw, ah = after.size
-    fw2, fh2 = fit(aw, ah, half_w, draw_h)
+    tile = prepare_tile(after, None, (half_w, draw_h), scale_factor, reducing_gap)
+    fw2, fh2 = tile.size
     ax = margin + half_w + (half_w - fw2) // 2
     ay = margin + (draw_h - fh2) // 2
-    canvas_img.paste(after.convert('RGB').resize((fw2, fh2), Image.LANCZOS), (ax, ay))
+    canvas_img.paste(tile, (ax, ay))
 
     return canvas_img
 
-def export_jpeg(out_path: Path, before: Image.Image, after: Image.Image, quality: int = 92, scale_factor: float = 0.85) -> Path:
+def render_preview(before: Image.Image, after: Image.Image, max_w: int, max_h: int, scale_factor: float = 0.85) -> Image.Image:
+    """The compose_preview_image layout rendered directly at screen size (one fast resample per half)."""
+    return compose_preview_image(before, after, scale_factor=scale_factor,
+                                 size=canvas_size_within(max_w, max_h), reducing_gap=3.0)
+
+JPEG_SUBSAMPLING = ("4:4:4", "4:2:2", "4:2:0")
+MIN_TARGET_QUALITY = 40  # a size target never pushes quality below this
+
+def export_jpeg(out_path: Path, before: Image.Image, after: Image.Image, quality: int = 92, scale_factor: float = 0.85,
+                **options) -> Path:
     canvas_img = compose_preview_image(before, after, scale_factor=scale_factor)
+    try:
+        return save_jpeg(canvas_img, out_path, quality=quality, **options)
+    finally:
+        canvas_img.close()
+
+def _encode_jpeg(img: Image.Image, quality: int, progressive: bool, subsampling: Optional[str]) -> bytes:
+    buf = BytesIO()
+    img.save(buf, 'JPEG', quality=quality, optimize=True, progressive=progressive,
+             **({"subsampling": subsampling} if subsampling else {}))
+    return buf.getvalue()
+
+def encode_jpeg_to_size(img: Image.Image, max_bytes: int, quality: int = 92, min_quality: int = MIN_TARGET_QUALITY,
+                        progressive: bool = False, subsampling: Optional[str] = None) -> tuple[bytes, int]:
+    """(data, quality): the highest quality up to ``quality`` whose encoding fits in ``max_bytes``.
+
+    Binary search over the quality, each attempt encoded into memory from the same
+    ``img``. File size grows with quality, so this takes about log2(quality -
+    min_quality) encodes, or one when ``quality`` already fits. The floor is
+    ``min_quality`` or ``quality``, whichever is lower. If nothing fits, the floor's
+    encoding is returned; callers compare its length with ``max_bytes``.
+    """
+    min_quality = min(quality, min_quality)
+    with trace.span("jpeg.fit", target=max_bytes) as sp:
+        best = _encode_jpeg(img, quality, progressive, subsampling)
+        attempts, found = 1, quality
+        if len(best) > max_bytes:
+            lo, hi = min_quality, quality - 1
+            floor, best, found = best, b"", min_quality  # the last attempt that didn't fit is the lowest quality tried
+            while lo <= hi:
+                q = (lo + hi) // 2
+                data = _encode_jpeg(img, q, progressive, subsampling); attempts += 1
+                if len(data) <= max_bytes:
+                    best, found, lo = data, q, q + 1
+                else:
+                    floor, hi = data, q - 1
+            best = best or floor  # nothing fitted: the search ended by trying min_quality
+        sp.set(quality=found, attempts=attempts, size=len(best), fits=len(best) <= max_bytes)
+    return best, found
+
+def jpeg_over_budget(path: Path, max_bytes: Optional[int]) -> str:
+    """A warning when a size-targeted JPEG still came out above ``max_bytes``; "" otherwise."""
+    if not max_bytes:
+        return ""
+    try:
+        size = path.stat().st_size
+    except OSError:
+        return ""
+    if size <= max_bytes:
+        return ""
+    return f"{path.name} is {math.ceil(size / 1024)} KB, over the {max_bytes // 1024} KB target even at the lowest quality"
+
+def save_jpeg(canvas_img: Image.Image, out_path: Path, quality: int = 92, max_bytes: Optional[int] = None,
+              progressive: bool = False, subsampling: Optional[str] = None) -> Path:
+    """Encode an already-composed canvas (the only step Save repeats after a cached render).
+
+    With ``max_bytes``, ``quality`` is the upper bound for encode_jpeg_to_size.
+    """
     out_path = out_path.with_suffix('.jpg')
-    canvas_img.save(out_path, 'JPEG', quality=quality, optimize=True)
+    if max_bytes:
+        data, _ = encode_jpeg_to_size(canvas_img, max_bytes, quality, progressive=progressive, subsampling=subsampling)
+        with trace.span("jpeg.write", file=out_path.name):
+            out_path.write_bytes(data)
+        return out_path
+    with trace.span("jpeg.encode", file=out_path.name):  # encode and write are one call
+        canvas_img.save(out_path, 'JPEG', quality=quality, optimize=True, progressive=progressive,
+                        **({"subsampling": subsampling} if subsampling else {}))
     return out_path
+
+# ---------------- Several outputs from one decode ----------------
+
+OUTPUT_KINDS = ("PDF", "JPEG", "THUMB")
+THUMB_SUFFIX = {"JPEG": ".jpg", "WEBP": ".webp"}
+
+def output_paths(main: Path, kinds: Sequence[str], thumb_format: str = "JPEG") -> Dict[str, Path]:
+    """Where each output kind goes: next to ``main`` with the same stem; the thumbnail gets a ``_thumb`` suffix."""
+    paths: Dict[str, Path] = {}
+    for kind in kinds:
+        if kind == "THUMB":
+            paths[kind] = main.with_name(main.with_suffix("").name + "_thumb" + THUMB_SUFFIX.get(thumb_format, ".jpg"))
+        else:
+            paths[kind] = main.with_suffix(".pdf" if kind == "PDF" else ".jpg")
+    return paths
+
+def save_thumbnail(before: Image.Image, after: Image.Image, out_path: Path, max_side: int = 800,
+                   scale_factor: float = 0.85, quality: int = 85) -> Path:
+    """The composed layout rendered straight at ``max_side`` px, saved as JPEG or WEBP by suffix."""
+    img = render_preview(before, after, max_side, max_side, scale_factor=scale_factor)
+    fmt = "WEBP" if out_path.suffix.lower() == ".webp" else "JPEG"
+    try:
+        with trace.span("thumb.encode", file=out_path.name):
+            img.save(out_path, fmt, quality=quality, **({"optimize": True} if fmt == "JPEG" else {"method": 4}))
+    finally:
+        img.close()
+    return out_path
+
+def export_outputs(paths: Dict[str, Path], before: Image.Image, after: Image.Image, scale_factor: float = 0.85,
+                   quality: int = 92, pdf: Optional[dict] = None, thumb_size: int = 800, thumb_quality: int = 85,
+                   canvas: Optional[Callable[[], Image.Image]] = None, jpeg: Optional[dict] = None) -> Dict[str, Path]:
+    """Write every output in ``paths`` (kind -> file, see output_paths) from the same cropped halves.
+
+    The encoders run on threads (Pillow and zlib release the GIL while encoding),
+    so three outputs take about as long as the slowest one. ``canvas`` builds the
+    composed image for JPEG; it defaults to compose_preview_image and lets the GUI
+    pass its cached render. ``jpeg`` holds save_jpeg's size target and encoder options.
+    """
+    tasks: Dict[str, Callable[[], Path]] = {}
+    if "PDF" in paths:
+        tasks["PDF"] = lambda: export_pdf(paths["PDF"], before, after, scale_factor=scale_factor, **(pdf or {}))
+    if "JPEG" in paths:
+        # A canvas passed in belongs to the caller (e.g. a cache); one made here is closed once encoded.
+        tasks["JPEG"] = ((lambda: save_jpeg(canvas(), paths["JPEG"], quality=quality, **(jpeg or {}))) if canvas else
+                         (lambda: export_jpeg(paths["JPEG"], before, after, quality=quality, scale_factor=scale_factor,
+                                              **(jpeg or {}))))
+    if "THUMB" in paths:
+        tasks["THUMB"] = lambda: save_thumbnail(before, after, paths["THUMB"], thumb_size, scale_factor, thumb_quality)
+    if len(tasks) == 1:
+        return {kind: fn() for kind, fn in tasks.items()}
+    with ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix="encode") as ex:
+        futures = {kind: ex.submit(trace.in_context(fn)) for kind, fn in tasks.items()}
+        return {kind: fut.result() for kind, fut in futures.items()}
+
+# ---------------- Multi-page PDF (batch) ----------------
+
+def _pdf_text(s: str) -> bytes:
+    try:
+        raw = s.encode("ascii")
+        return b"(" + raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+    except UnicodeEncodeError:
+        return b"<FEFF" + s.encode("utf-16-be").hex().upper().encode() + b">"
+
+class PdfBook:
+    """One-page-per-pair PDF written straight to disk.
+
+    reportlab keeps every page's image data in memory until ``save()``, so this
+    writes each page's objects as soon as it is added and only remembers byte
+    offsets; memory stays flat however many pairs go in. The page layout matches
+    export_pdf. Use as a context manager or call close().
+    """
+
+    def __init__(self, out_path: Path, scale_factor: float = 0.85, dpi: Optional[float] = None,
+                 image_format: str = "flate", jpeg_quality: int = 90):
+        self.out_path = out_path
+        self.scale_factor, self.dpi = scale_factor, dpi
+        self.image_format, self.jpeg_quality = image_format, jpeg_quality
+        self._fh = open(out_path, "wb")
+        self._offsets: dict[int, int] = {}
+        self._next_id = 3  # 1 = catalog, 2 = page tree; both written on close
+        self._pages: list[int] = []
+        self._outline: list[tuple[str, int]] = []
+        self._fh.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def __enter__(self) -> "PdfBook":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def page_count(self) -> int:
+        return len(self._pages)
+
+    def _alloc(self) -> int:
+        self._next_id += 1
+        return self._next_id - 1
+
+    def _write_obj(self, obj_id: int, body: bytes, stream: Optional[bytes] = None) -> None:
+        self._offsets[obj_id] = self._fh.tell()
+        self._fh.write(b"%d 0 obj\n" % obj_id)
+        if stream is None:
+            self._fh.write(body + b"\nendobj\n")
+        else:
+            self._fh.write(body[:-2] + b"/Length %d >>\nstream\n" % len(stream))  # body is a << ... >> dict
+            self._fh.write(stream + b"\nendstream\nendobj\n")
+
+    def _image_obj(self, img: Image.Image, box_w: float, box_h: float) -> int:
+        src = _untouched_jpeg(img)
+        target = (max(1, math.ceil(box_w / 72 * self.dpi)), max(1, math.ceil(box_h / 72 * self.dpi))) if self.dpi else None
+        if src and (target is None or img.width <= target[0] * PASSTHROUGH_SLACK):
+            data, size, gray, filt = Path(src).read_bytes(), img.size, img.mode == "L", b"/DCTDecode"
+        else:
+            if target and img.width > target[0]:
+                with trace.span("resample"):
+                    im = resize_rgb(img, target)
+            else:
+                im = img if img.mode in ("RGB", "L") else to_rgb(img)
+            size, gray = im.size, im.mode == "L"
+            with trace.span("pdf.encode", images=self.image_format):
+                if self.image_format == "jpeg":
+                    buf = BytesIO(); im.save(buf, "JPEG", quality=self.jpeg_quality)
+                    data, filt = buf.getvalue(), b"/DCTDecode"
+                else:
+                    data, filt = zlib.compress(im.tobytes(), 6), b"/FlateDecode"
+        obj_id = self._alloc()
+        with trace.span("pdf.write"):
+            self._write_obj(obj_id, b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s "
+                            b"/BitsPerComponent 8 /Filter %s >>" % (size[0], size[1], b"/DeviceGray" if gray else b"/DeviceRGB", filt), data)
+        return obj_id
+
+    def add_page(self, before: Image.Image, after: Image.Image, title: Optional[str] = None) -> int:
+        """Write one before/after page; ``title`` adds an outline (bookmark) entry. Returns the page number."""
+        ops = []
+        for i, img in enumerate((before, after)):
+            fw, fh = fit_rect(img.width, img.height, HALF_W, DRAW_H)
+            fw *= self.scale_factor; fh *= self.scale_factor
+            x = MARGIN + HALF_W * i + (HALF_W - fw) / 2; y = MARGIN + (DRAW_H - fh) / 2
+            ops.append((self._image_obj(img, fw, fh), b"q %.4f 0 0 %.4f %.4f %.4f cm /Im%d Do Q" % (fw, fh, x, y, i)))
+        content_id, page_id = self._alloc(), self._alloc()
+        self._write_obj(content_id, b"<< /Filter /FlateDecode >>", zlib.compress(b"\n".join(op for _, op in ops)))
+        xobjs = b" ".join(b"/Im%d %d 0 R" % (i, obj) for i, (obj, _) in enumerate(ops))
+        self._write_obj(page_id, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.4f %.4f] /Resources << /XObject << %s >> >> /Contents %d 0 R >>"
+                        % (LETTER_LANDSCAPE[0], LETTER_LANDSCAPE[1], xobjs, content_id))
+        self._pages.append(page_id)
+        if title:
+            self._outline.append((title, page_id))
+        self._fh.flush()
+        return len(self._pages)
+
+    def close(self) -> Path:
+        if self._fh.closed:
+            return self.out_path
+        catalog_extra = b""
+        if self._outline:
+            root = self._alloc()
+            ids = [self._alloc() for _ in self._outline]
+            for n, ((title, page_id), obj_id) in enumerate(zip(self._outline, ids)):
+                links = b""
+                if n > 0: links += b" /Prev %d 0 R" % ids[n - 1]
+                if n + 1 < len(ids): links += b" /Next %d 0 R" % ids[n + 1]
+                self._write_obj(obj_id, b"<< /Title %s /Parent %d 0 R /Dest [%d 0 R /Fit]%s >>" % (_pdf_text(title), root, page_id, links))
+            self._write_obj(root, b"<< /Type /Outlines /First %d 0 R /Last %d 0 R /Count %d >>" % (ids[0], ids[-1], len(ids)))
+            catalog_extra = b" /Outlines %d 0 R /PageMode /UseOutlines" % root
+        kids = b" ".join(b"%d 0 R" % p for p in self._pages)
+        self._write_obj(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self._pages)))
+        self._write_obj(1, b"<< /Type /Catalog /Pages 2 0 R%s >>" % catalog_extra)
+
+        xref = self._fh.tell()
+        self._fh.write(b"xref\n0 %d\n0000000000 65535 f \n" % self._next_id)
+        for obj_id in range(1, self._next_id):
+            self._fh.write(b"%010d 00000 n \n" % self._offsets[obj_id])
+        self._fh.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (self._next_id, xref))
+        self._fh.close()
+        return self.out_path
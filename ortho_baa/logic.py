@@ -1,19 +1,52 @@
 from __future__ import annotations
+import math, threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from io import BytesIO
 from pathlib import Path
-from typing import List, Optional, Tuple, Dict
-from PIL import Image, UnidentifiedImageError
-
-# Enable HEIC/HEIF/AVIF if pillow-heif is installed
-try:
-    from pillow_heif import register_heif_opener  # type: ignore
-    register_heif_opener()
-except Exception:
-    pass
+from typing import Callable, List, Optional, Tuple, TypeVar
+from PIL import ExifTags, Image, UnidentifiedImageError
+from .utils import fit_rect, to_rgb, resize_rgb
+from . import trace
 
 SUPPORTED_EXTS = {".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp", ".heic", ".heif", ".avif"}
+HEIF_EXTS = {".heic", ".heif", ".avif"}
+
+_heif_lock = threading.Lock()
+_heif_ok: Optional[bool] = None
+
+def ensure_heif_opener() -> bool:
+    """Enable HEIC/HEIF/AVIF if pillow-heif is installed. Done on the first such file, not at import."""
+    global _heif_ok
+    with _heif_lock:
+        if _heif_ok is None:
+            try:
+                from pillow_heif import register_heif_opener  # type: ignore
+                register_heif_opener()
+                _heif_ok = True
+            except Exception:
+                _heif_ok = False
+    return _heif_ok
+
+def open_image(p: Path) -> Image.Image:
+    """Image.open, registering the HEIF opener first when ``p`` needs it."""
+    if p.suffix.lower() in HEIF_EXTS:
+        ensure_heif_opener()
+    return Image.open(p)
+
+def release_file(im: Image.Image) -> Image.Image:
+    """Close the file behind a loaded ``im``; its pixels stay usable.
+
+    load() already does this for single-frame files, but leaves multi-frame ones
+    (multi-page TIFF, MPO) open so other frames can be read. We never read them.
+    """
+    fp = getattr(im, "fp", None)
+    if fp is not None:
+        fp.close()
+        im.fp = None
+    return im
 
-@dataclass
+@dataclass(frozen=True)
 class CropParams:
     enabled: bool
     top: int
@@ -25,51 +58,175 @@ def load_image(p: Path) -> Optional[Image.Image]:
     if p.suffix.lower() not in SUPPORTED_EXTS:
         return None
     try:
-        im = Image.open(p)
-        im.load()  # force read; avoids lazy decoding errors later
-        return im
+        with trace.span("decode", file=p.name):
+            im = open_image(p)
+            im.load()  # force read; avoids lazy decoding errors later
+        return release_file(im)
     except (UnidentifiedImageError, OSError):
         return None
 
-def crop_top_then_bottom(img: Image.Image, params: CropParams) -> Image.Image:
+def load_image_reduced(p: Path, target: Tuple[float, float], params: CropParams) -> Optional[Tuple[Image.Image, CropParams]]:
+    """Load ``p`` no larger than needed to fill ``target`` (w, h px) after cropping with ``params``.
+
+    JPEG is scaled inside the decoder and HEIF/AVIF may decode an embedded thumbnail
+    (``Image.draft``); other formats are box-reduced right after decoding. Returns
+    the image together with ``params`` translated into its pixel coordinates.
+    """
+    if not p.exists() or not p.is_file():
+        return None
+    if p.suffix.lower() not in SUPPORTED_EXTS:
+        return None
+    try:
+        with trace.span("decode", file=p.name, reduced=True):
+            im = open_image(p)
+            orig_w, orig_h = im.size
+            r = decode_reduction(im.size, params, target)
+            if r > 1:
+                im.draft(None, (math.ceil(orig_w / r), math.ceil(orig_h / r)))
+            im.load()
+            release_file(im)
+            factor = int(r * im.width / orig_w)
+            if factor >= 2:
+                reduced = im.reduce(factor)
+                im.close()  # frees the full decode now rather than whenever the caller lets go
+                im = reduced
+    except (UnidentifiedImageError, OSError):
+        return None
+    return im, scale_params(params, im.height / orig_h)
+
+def load_image_draft(p: Path, max_side: int) -> Optional[Tuple[Image.Image, Tuple[int, int]]]:
+    """Decode ``p`` with the decoder's own downscaling towards ``max_side`` (longest side).
+
+    JPEG scales by powers of two inside the decoder and HEIF/AVIF may use an embedded
+    thumbnail; other formats decode in full. Returns the image and the full frame size,
+    so ``img.size == full`` means the full-resolution frame was decoded.
+    """
+    if not p.exists() or not p.is_file() or p.suffix.lower() not in SUPPORTED_EXTS:
+        return None
+    try:
+        with trace.span("decode", file=p.name, draft=True):
+            im = open_image(p)
+            full = im.size
+            r = max(full) / max_side
+            if r > 1:
+                r = 2 ** round(math.log2(r))  # nearest DCT scale: a 4000 px JPEG gives a 2000 px proxy, not 4000
+                im.draft(None, (math.ceil(full[0] / r), math.ceil(full[1] / r)))
+            im.load()
+            release_file(im)
+    except (UnidentifiedImageError, OSError):
+        return None
+    return im, full
+
+def _exif_thumbnail(im: Image.Image) -> Optional[Image.Image]:
+    raw = im.info.get("exif")
+    if not raw:
+        return None
+    tiff = raw[6:] if raw.startswith(b"Exif\x00\x00") else raw
+    ifd1 = im.getexif().get_ifd(ExifTags.IFD.IFD1)
+    offset, length = ifd1.get(0x0201), ifd1.get(0x0202)  # JPEGInterchangeFormat, ...Length
+    if not offset or not length:
+        return None
+    thumb = Image.open(BytesIO(tiff[offset:offset + length]))
+    thumb.load()
+    return thumb
+
+def embedded_thumbnail(p: Path, min_size: Tuple[int, int] = (1, 1)) -> Optional[Tuple[Image.Image, Tuple[int, int]]]:
+    """The preview stored inside ``p`` and the full frame size, without decoding the frame.
+
+    HEIF/AVIF: the smallest pillow-heif thumbnail of at least ``min_size`` (it only
+    offers ones with the frame's crop and rotation). JPEG: the EXIF thumbnail, if its
+    aspect ratio matches the frame. Either way the thumbnail is oriented like the
+    decoded frame, so crop values scale onto it.
+    """
+    if not p.exists() or not p.is_file() or p.suffix.lower() not in SUPPORTED_EXTS:
+        return None
+    try:
+        with trace.span("decode", file=p.name, thumbnail=True):
+            im = open_image(p)
+            full = im.size
+            if p.suffix.lower() in HEIF_EXTS and im.draft(None, min_size) is not None:
+                im.load()
+                thumb = release_file(im)
+            else:
+                with im:
+                    thumb = _exif_thumbnail(im) if im.format == "JPEG" else None
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        return None
+    if thumb is None or not thumb.height or abs(thumb.width / thumb.height - full[0] / full[1]) > 0.02:
+        return None  # e.g. a letterboxed 160x120 thumbnail of a 3:2 photo
+    return thumb, full
+
+T = TypeVar("T"); R = TypeVar("R")
+
+def map_pair(fn: Callable[[T], R], before: T, after: T) -> Tuple[R, R]:
+    """(fn(before), fn(after)), with the before half on a helper thread.
+
+    Pillow releases the GIL while decoding, resampling and encoding, so preparing
+    both halves of a pair this way takes about as long as the slower one.
+    """
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="pair") as ex:
+        fut = ex.submit(trace.in_context(fn), before)
+        a = fn(after)
+        return fut.result(), a
+
+def crop_box(size: Tuple[int, int], params: CropParams) -> Tuple[int, int, int, int]:
+    """The region of an image of ``size`` that crop_top_then_bottom keeps."""
+    w, h = size
     if not params.enabled:
+        return (0, 0, w, h)
+    h1 = min(params.top, h)
+    return (0, h1 - params.bottom if h1 > params.bottom else 0, w, h1)
+
+def decode_reduction(size: Tuple[int, int], params: CropParams, target: Tuple[float, float]) -> float:
+    """How many times larger than ``target`` the cropped region is (never below 1)."""
+    x0, y0, x1, y1 = crop_box(size, params)
+    cw, ch = x1 - x0, y1 - y0
+    fw, fh = fit_rect(cw, ch, *target)
+    if fw <= 0 or fh <= 0:
+        return 1.0
+    return max(1.0, min(cw / fw, ch / fh))
+
+def scale_params(params: CropParams, s: float) -> CropParams:
+    if not params.enabled or s == 1:
+        return params
+    return CropParams(True, max(1, round(params.top * s)), max(1, round(params.bottom * s)))
+
+def crop_top_then_bottom(img: Image.Image, params: CropParams) -> Image.Image:
+    # Keep the top N rows, then the bottom M rows of those: one crop of the combined box.
+    box = crop_box(img.size, params)
+    if box == (0, 0, img.width, img.height):
         return img
-    w, h = img.size
-    # Keep top N rows
-    stage1 = img.crop((0, 0, w, min(params.top, h)))
-    h1 = stage1.height
-    # Then keep bottom M rows from that
-    if h1 > params.bottom:
-        return stage1.crop((0, h1 - params.bottom, w, h1))
-    return stage1
+    with trace.span("crop"):
+        return img.crop(box)
+
+def prepare_tile(img: Image.Image, params: Optional[CropParams], box: Optional[Tuple[float, float]] = None,
+                 scale_factor: float = 1.0, reducing_gap: Optional[float] = None) -> Image.Image:
+    """Crop ``img`` and turn it into an RGB image fitted into ``box`` (w, h px) times ``scale_factor``.
+
+    One crop, one resample, and a mode conversion only when the source isn't RGB.
+    Pillow's ``resize(box=...)`` would skip the crop but samples pixels just outside
+    the box, so the output would differ from cropping first.
+    """
+    cropped = crop_top_then_bottom(img, params) if params else img
+    if box is None:
+        return to_rgb(cropped)
+    fw, fh = fit_rect(cropped.width, cropped.height, *box)
+    with trace.span("resample"):
+        return resize_rgb(cropped, (max(1, int(fw * scale_factor)), max(1, int(fh * scale_factor))), reducing_gap)
+
+def pair_role(p: Path) -> Optional[Tuple[str, str]]:
+    """("<pair key>", "before"|"after") for names like ``X_before.jpg`` / ``X after.png``, else None."""
+    stem = p.stem.lower()
+    if stem.endswith((" before", "-before", "_before")):
+        return stem.rsplit("before", 1)[0].rstrip(" -_"), "before"
+    if stem.endswith((" after", "-after", "_after")):
+        return stem.rsplit("after", 1)[0].rstrip(" -_"), "after"
+    return None
+
+def pair_stem(key: str) -> str:
+    return key.strip() or "Pair"
 
 def guess_pairs_in_folder(folder: Path) -> List[Tuple[Path, Path, str]]:
-    files = [p for p in folder.iterdir() if p.is_file() and p.suffix.lower() in SUPPORTED_EXTS]
-    files.sort(key=lambda x: x.name.lower())
-    pairs: List[Tuple[Path, Path, str]] = []
-
-    by_stem: Dict[str, Dict[str, Path]] = {}
-    for f in files:
-        stem = f.stem.lower()
-        if stem.endswith((" before", "-before", "_before")):
-            key = stem.rsplit("before", 1)[0].rstrip(" -_")
-            by_stem.setdefault(key, {})["before"] = f
-        elif stem.endswith((" after", "-after", "_after")):
-            key = stem.rsplit("after", 1)[0].rstrip(" -_")
-            by_stem.setdefault(key, {})["after"] = f
-
-    for k, v in list(by_stem.items()):
-        if "before" in v and "after" in v:
-            base = k.strip() or "Pair"
-            pairs.append((v["before"], v["after"], base))
-
-    used = set([p for trio in pairs for p in (trio[0], trio[1])])
-    remaining = [f for f in files if f not in used]
-
-    for i in range(0, len(remaining), 2):
-        if i + 1 < len(remaining):
-            b, a = remaining[i], remaining[i + 1]
-            base = b.stem
-            pairs.append((b, a, base))
-
-    return pairs
+    """(before, after, stem) for the images in ``folder``, paired the way batch exports pair them."""
+    from .pairindex import iter_pairs
+    return list(iter_pairs(folder, use_cache=False, ordered=True))
@@ -1,14 +1,18 @@
 from __future__ import annotations
-import sys, webbrowser
+import multiprocessing, os, sys, time, webbrowser
 from pathlib import Path
 from PySide6.QtWidgets import QApplication, QMessageBox
-from PySide6.QtCore import QTimer, QUrl
+from PySide6.QtCore import QThreadPool, QTimer, QUrl
 from PySide6.QtGui import QDesktopServices
-from .ui import MainWindow
-from .config import load_config, save_config
-from .logic import load_image, CropParams, crop_top_then_bottom, guess_pairs_in_folder
-from .exporters import export_pdf, export_jpeg, compose_preview_image
-from .utils import suggest_output_basename_from_two_with_prefs
+from .ui import BackgroundJob, MainWindow, PREVIEW_W, PREVIEW_H
+from .config import load_config, save_config, CACHE_DIR, STARTUP_PROBE_ENV
+from .logic import CropParams, crop_top_then_bottom, map_pair
+from .exporters import export_outputs, output_paths, compose_preview_image, render_preview, jpeg_over_budget, CANVAS_PX
+from .cache import ProxyCache, RenderCache, file_identity
+from .batch import BatchSettings, make_jobs, export_book, run_parallel_batch
+from .manifest import ExportManifest
+from .utils import suggest_output_basename_from_two_with_prefs, to_rgb
+from . import trace
 
 def open_file(path: Path) -> None:
     try:
@@ -20,7 +24,9 @@ def open_file(path: Path) -> None:
             pass
 
 def run_app():
+    multiprocessing.freeze_support()  # batch workers re-enter here in frozen builds
     cfg = load_config()
+    trace.install_log_sink(cfg)
     app = QApplication(sys.argv)
     win = MainWindow(out_dir_default=Path(cfg["last_out_dir"]), output_format_default=cfg.get("output_format","PDF"))
 
@@ -28,6 +34,9 @@ def run_app():
     win.name_id_cb.setChecked(bool(np.get("use_id", True)))
     win.name_first_cb.setChecked(bool(np.get("use_first", True)))
     win.name_last_cb.setChecked(bool(np.get("use_last", True)))
+    win.batch_single_cb.setChecked(bool(cfg.get("batch_single_pdf", False)))
+    for kind, cb in win.also_cbs.items():
+        cb.setChecked(kind in [k.upper() for k in cfg.get("extra_outputs", [])])
 
     def current_name_prefs():
         return {
@@ -59,14 +68,87 @@ def run_app():
     win.name_first_cb.stateChanged.connect(lambda _: on_parts_changed())
     win.name_last_cb.stateChanged.connect(lambda _: on_parts_changed())
 
-    def get_effective_images():
-        b_img = win.before.get_effective_image()
-        a_img = win.after.get_effective_image()
+    # Cropped full-resolution RGB halves and composed canvases, shared between full-size Preview and Save.
+    render_cache = RenderCache(int(cfg.get("render_cache_mb", 512)) * 1024 ** 2)
+    # Screen-sized proxies kept across sessions: a file dropped before shows without being decoded.
+    proxy_mb = int(cfg.get("proxy_cache_mb", 256))
+    win.before.proxy_cache = win.after.proxy_cache = ProxyCache(CACHE_DIR / "proxies", proxy_mb * 1024 ** 2) if proxy_mb > 0 else None
+
+    # Save, full-size preview and batch run one at a time on their own pool, so
+    # pane thumbnail loads on the global pool never queue behind an export.
+    jobs_pool = QThreadPool(); jobs_pool.setMaxThreadCount(1)
+    current = {"job": None}
+
+    def start_job(fn, on_done, message: str) -> None:
+        if current["job"] is not None: return
+        job = BackgroundJob(fn)
+        job.signals.progress.connect(lambda pct, text: (win.progress.setValue(pct), text and win.status.showMessage(text)))
+        job.signals.done.connect(lambda res: (finish_job(), on_done(res)))
+        job.signals.failed.connect(lambda err: (finish_job(), win.status.showMessage("Failed."), QMessageBox.critical(win, "Failed", err)))
+        current["job"] = job; win.set_busy(True)
+        win.progress.setValue(0); win.status.showMessage(message)
+        jobs_pool.start(job)
+
+    def finish_job():
+        current["job"] = None; win.set_busy(False)
+
+    def cancel_job():
+        if current["job"] is None: return
+        current["job"].cancel(); win.cancel_btn.setEnabled(False); win.status.showMessage("Cancelling…")
+    win.cancelRequested.connect(cancel_job)
+    app.aboutToQuit.connect(lambda: (cancel_job(), jobs_pool.waitForDone()))
+
+    def source_key(pane, crop):
+        try:
+            return (file_identity(pane.path), crop)
+        except (OSError, TypeError):
+            return None
+
+    def prepared_half(pane, crop):
+        # Worker side: crop was read on the GUI thread, and the panes stay locked while a job runs.
+        full = pane.full_image()  # the first call decodes the full frame
+        if full is None: return None
+        key = source_key(pane, crop)
+        make = lambda: to_rgb(crop_top_then_bottom(full, crop))
+        if key is None: return make()
+        return render_cache.get_or_create(("rgb", key), make)
+
+    def prepared_halves(crops):
+        # Both halves decode at once; the pair takes about as long as its slower image.
+        b_img, a_img = map_pair(lambda half: prepared_half(*half), (win.before, crops[0]), (win.after, crops[1]))
         if b_img is None or a_img is None:
-            QMessageBox.warning(win, "Missing images", "Please add both Before and After images.")
-            return None, None
+            raise ValueError(f"Could not read: {win.before.path if b_img is None else win.after.path}")
         return b_img, a_img
 
+    def composed_canvas(b_img, a_img, scale: float, crops):
+        b_key, a_key = source_key(win.before, crops[0]), source_key(win.after, crops[1])
+        if b_key is None or a_key is None:
+            return compose_preview_image(b_img, a_img, scale_factor=scale)
+        return render_cache.get_or_create(("canvas", b_key, a_key, scale, CANVAS_PX),
+                                          lambda: compose_preview_image(b_img, a_img, scale_factor=scale))
+
+    def pdf_options():
+        return {"dpi": float(cfg.get("pdf_dpi", 0)) or None,
+                "image_format": cfg.get("pdf_images", "flate"),
+                "jpeg_quality": int(cfg.get("pdf_jpeg_quality", 90))}
+
+    def jpeg_options():
+        return {"max_bytes": int(cfg.get("jpeg_max_kb", 0)) * 1024 or None,
+                "progressive": bool(cfg.get("jpeg_progressive", False)),
+                "subsampling": str(cfg.get("jpeg_subsampling", "")) or None}
+
+    def images_ready() -> bool:
+        if win.before.is_loading or win.after.is_loading:
+            QMessageBox.information(win, "Still loading", "Please wait until both images have finished loading.")
+            return False
+        if win.before.path is None or win.after.path is None:
+            QMessageBox.warning(win, "Missing images", "Please add both Before and After images.")
+            return False
+        return True
+
+    def current_crops():
+        return win.before.crop_params(), win.after.crop_params()
+
     def do_export(preview: bool = False):
         out_dir = Path(win.out_dir.text().strip() or cfg["last_out_dir"])
         out_dir.mkdir(parents=True, exist_ok=True)
@@ -86,64 +168,139 @@ def run_app():
         if fmt == "JPEG" and not out_path.suffix.lower().endswith(".jpg"):
             out_path = out_path.with_suffix(".jpg")
 
-        b_img, a_img = get_effective_images()
-        if b_img is None:
+        if not images_ready():
             return
-
-        win.status.showMessage("Exporting…"); win.progress.setValue(10); app.processEvents()
         scale = float(cfg.get("scale_factor", 0.85))
 
         if preview:
-            img = compose_preview_image(b_img, a_img, scale_factor=scale)
+            # Screen-sized proxies rendered straight at dialog size; the full composite is only built on zoom.
+            b_img = win.before.get_display_image(); a_img = win.after.get_display_image()
+            if b_img is None or a_img is None:
+                QMessageBox.warning(win, "Missing images", "Please add both Before and After images."); return
+            img = render_preview(b_img, a_img, PREVIEW_W, PREVIEW_H, scale_factor=scale)
             win.progress.setValue(100); win.status.showMessage("Preview ready.")
-            win.show_preview(img)
+            win.show_preview(img, canvas_size=CANVAS_PX)
             return
 
-        if fmt == "PDF":
-            out_file = export_pdf(out_path, b_img, a_img, scale_factor=scale)
-        else:
-            out_file = export_jpeg(out_path, b_img, a_img, quality=92, scale_factor=scale)
+        crops, pdf, extras = current_crops(), pdf_options(), win.extra_outputs()
+        kinds = (fmt,) + extras
+        paths = output_paths(out_path, kinds, str(cfg.get("thumb_format", "JPEG")).upper())
+
+        def work(job):
+            t = time.perf_counter()
+            # Spans are collected for the status bar breakdown whether or not the trace log is on.
+            with trace.collect() as spans, trace.span("save", format="+".join(kinds)):
+                job.report(10, "Reading images…")
+                b_img, a_img = prepared_halves(crops)
+                if job.cancelled: return None
+                job.report(50, "Exporting…")
+                # Every output comes from the same cropped halves; the encodes run side by side.
+                jpeg = jpeg_options()
+                outs = export_outputs(paths, b_img, a_img, scale_factor=scale, quality=92, pdf=pdf,
+                                      thumb_size=int(cfg.get("thumb_size", 800)), jpeg=jpeg,
+                                      canvas=lambda: composed_canvas(b_img, a_img, scale, crops))
+            warning = jpeg_over_budget(outs["JPEG"], jpeg["max_bytes"]) if "JPEG" in outs else ""
+            return outs, time.perf_counter() - t, spans, warning
 
-        win.progress.setValue(100); win.status.showMessage(f"Saved to: {out_file}")
-        try: win.open_folder_btn.setEnabled(True)
-        except Exception: pass
+        def done(res):
+            if res is None:
+                win.progress.setValue(0); win.status.showMessage("Save cancelled."); return
+            outs, total, spans, warning = res
+            more = f" (+{len(outs) - 1} more)" if len(outs) > 1 else ""
+            note = f" Warning: {warning}." if warning else ""
+            win.progress.setValue(100); win.status.showMessage(f"Saved to: {outs[fmt]}{more} ({total:.2f} s: {trace.format_breakdown(spans.breakdown())}){note}")
+            win.open_folder_btn.setEnabled(True)
+            cfg["last_out_dir"] = str(out_dir); cfg["output_format"] = fmt; cfg["extra_outputs"] = list(extras); cfg["name_parts"] = current_name_prefs(); save_config(cfg)
 
-        cfg["last_out_dir"] = str(out_dir); cfg["output_format"] = fmt; cfg["name_parts"] = current_name_prefs(); save_config(cfg)
+        start_job(work, done, "Exporting…")
 
     def do_batch():
         from PySide6.QtWidgets import QFileDialog
         folder = QFileDialog.getExistingDirectory(win, "Choose folder containing pairs", str(Path.home()))
         if not folder: return
         folder = Path(folder)
-        pairs = guess_pairs_in_folder(folder)
-        if not pairs:
+        out_dir = Path(win.out_dir.text().strip() or cfg["last_out_dir"])
+        single_pdf = win.batch_single_cb.isChecked()
+        fmt = "PDF" if single_pdf else win.format_combo.currentText(); scale = float(cfg.get("scale_factor", 0.85))
+        jobs = make_jobs(folder, out_dir, fmt)
+        if not jobs:
             QMessageBox.information(win, "Nothing found", "No pairs detected in that folder.")
             return
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+        b_params = CropParams(win.before.crop_check.isChecked(), win.before.top_spin.value(), win.before.bottom_spin.value())
+        a_params = CropParams(win.after.crop_check.isChecked(),  win.after.top_spin.value(),  win.after.bottom_spin.value())
+        pdf = pdf_options()
+        settings = BatchSettings(b_params, a_params, fmt, scale, 92, bool(cfg.get("reduced_decode", False)),
+                                 pdf_dpi=pdf["dpi"], pdf_image_format=pdf["image_format"], pdf_jpeg_quality=pdf["jpeg_quality"],
+                                 extra_outputs=() if single_pdf else win.extra_outputs(), thumb_size=int(cfg.get("thumb_size", 800)),
+                                 thumb_format=str(cfg.get("thumb_format", "JPEG")).upper(),
+                                 jpeg_max_kb=int(cfg.get("jpeg_max_kb", 0)), jpeg_progressive=bool(cfg.get("jpeg_progressive", False)),
+                                 jpeg_subsampling=str(cfg.get("jpeg_subsampling", "")))
+        manifest = None if single_pdf else ExportManifest(out_dir)
+        skipped = []
+        if manifest is not None and cfg.get("batch_skip_unchanged", True):
+            jobs, skipped = manifest.pending(jobs, settings)
+        if not jobs:
+            win.status.showMessage(f"Batch: all {len(skipped)} pair(s) already up to date."); return
 
-        out_dir = Path(win.out_dir.text().strip() or cfg["last_out_dir"]); out_dir.mkdir(parents=True, exist_ok=True)
-        fmt = win.format_combo.currentText(); scale = float(cfg.get("scale_factor", 0.85))
+        workers = int(cfg.get("batch_workers", 0)) or None
+        budget = int(cfg.get("batch_mem_budget_mb", 0)) * 1024 ** 2 or None
 
-        win.progress.setValue(0); win.status.showMessage(f"Batch: processing {len(pairs)} pair(s)…"); app.processEvents()
+        def work(job):
+            done = failed = warned = 0; stage_totals = {}
+            if single_pdf:
+                results = export_book(jobs, settings, out_dir / f"{folder.name}_BeforeAndAfter.pdf")
+            else:
+                results = run_parallel_batch(jobs, settings, workers=workers, mem_budget=budget)
+            try:
+                with trace.span("batch", pairs=len(jobs), workers=workers):
+                    for res in results:
+                        done += 1; failed += not res.ok; warned += bool(res.warning)
+                        for k, v in res.timings.items(): stage_totals[k] = stage_totals.get(k, 0.0) + v
+                        if manifest is not None: manifest.record(res, settings)
+                        job.report(int(done / len(jobs) * 100), f"Batch: {done}/{len(jobs)} ({res.job.stem})…")
+                        if job.cancelled: break
+            finally:
+                results.close()  # on cancel: pending pairs are dropped, a single PDF is closed with the pages so far
+            return done, failed, warned, stage_totals, job.cancelled
 
-        for i, (b_path, a_path, stem) in enumerate(pairs, start=1):
-            b = load_image(b_path); a = load_image(a_path)
-            if not b or not a: continue
-            b_params = CropParams(win.before.crop_check.isChecked(), win.before.top_spin.value(), win.before.bottom_spin.value())
-            a_params = CropParams(win.after.crop_check.isChecked(),  win.after.top_spin.value(),  win.after.bottom_spin.value())
-            b_eff = crop_top_then_bottom(b, b_params); a_eff = crop_top_then_bottom(a, a_params)
-            out_path = out_dir / f"{stem}_BeforeAndAfter"
-            if fmt == "PDF": export_pdf(out_path.with_suffix(".pdf"), b_eff, a_eff, scale_factor=scale)
-            else: export_jpeg(out_path.with_suffix(".jpg"), b_eff, a_eff, quality=92, scale_factor=scale)
-            win.progress.setValue(int(i / len(pairs) * 100)); app.processEvents()
+        def finished(res):
+            done, failed, warned, stage_totals, cancelled = res
+            # Pairs run in worker processes, so the breakdown comes from each result's timings rather than spans.
+            breakdown = trace.format_breakdown(dict(sorted(stage_totals.items(), key=lambda kv: -kv[1])))
+            head = f"Batch cancelled after {done} of {len(jobs)} pair(s)" if cancelled else "Batch complete"
+            over = f" {warned} JPEG(s) over the size target." if warned else ""
+            win.status.showMessage(head + (f" ({failed} failed)." if failed else ".") + over + (f" {breakdown}" if breakdown else ""))
+            win.open_folder_btn.setEnabled(True)
+            cfg["last_out_dir"] = str(out_dir); cfg["output_format"] = win.format_combo.currentText(); cfg["batch_single_pdf"] = single_pdf; cfg["extra_outputs"] = list(win.extra_outputs()); cfg["name_parts"] = current_name_prefs(); save_config(cfg)
 
-        win.status.showMessage("Batch complete."); cfg["last_out_dir"] = str(out_dir); cfg["output_format"] = fmt; cfg["name_parts"] = current_name_prefs(); save_config(cfg)
+        start_job(work, finished, f"Batch: processing {len(jobs)} pair(s), {len(skipped)} up to date…")
 
     win.saveRequested.connect(lambda: do_export(preview=False))
     win.previewRequested.connect(lambda: do_export(preview=True))
     win.batchRequested.connect(do_batch)
 
+    def on_preview_zoom(full: bool):
+        if not full:
+            do_export(preview=True); return
+        if not images_ready(): return
+        crops, scale = current_crops(), float(cfg.get("scale_factor", 0.85))
+
+        def work(job):
+            b_img, a_img = prepared_halves(crops)
+            return None if job.cancelled else composed_canvas(b_img, a_img, scale, crops)
+
+        def done(img):
+            if img is None: win.status.showMessage("Preview cancelled."); return
+            win.progress.setValue(100); win.show_preview(img, full_size=True, canvas_size=CANVAS_PX); win.status.showMessage("Preview ready.")
+        start_job(work, done, "Rendering full-size preview…")
+    win.previewZoomRequested.connect(on_preview_zoom)
+
     suggest_name()
     win.show()
+    if os.environ.get(STARTUP_PROBE_ENV):  # python -m ortho_baa.bench --startup
+        QTimer.singleShot(0, lambda: (print(STARTUP_PROBE_ENV, flush=True), app.quit()))
     sys.exit(app.exec())
 
 if __name__ == "__main__":
@@ -0,0 +1,125 @@
+from __future__ import annotations
+import dataclasses, hashlib, json, os
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from .batch import BatchSettings, PairJob, PairResult
+from .exporters import output_paths
+
+# Append-only JSON lines, one per exported pair; the last line for an output wins.
+# Appending (instead of rewriting a JSON document) keeps every finished pair
+# recorded even if the batch is killed halfway through.
+MANIFEST_NAME = ".ortho_baa_manifest.jsonl"
+
+def _sha256(p: Path) -> str:
+    h = hashlib.sha256()
+    with open(p, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def file_signature(p: Path, hash_contents: bool = False) -> Dict[str, Any]:
+    st = os.stat(p)
+    sig: Dict[str, Any] = {"path": str(p), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if hash_contents:
+        sig["sha256"] = _sha256(p)
+    return sig
+
+def settings_signature(settings: BatchSettings) -> Dict[str, Any]:
+    # Round-trip through JSON so it compares equal to what was read back from disk.
+    sig = json.loads(json.dumps(dataclasses.asdict(settings)))
+    if not settings.extra_outputs:
+        # Keep manifests written before extra outputs existed valid.
+        for k in ("extra_outputs", "thumb_size", "thumb_format"):
+            sig.pop(k, None)
+    if not (settings.jpeg_max_kb or settings.jpeg_progressive or settings.jpeg_subsampling):
+        for k in ("jpeg_max_kb", "jpeg_progressive", "jpeg_subsampling"):
+            sig.pop(k, None)
+    return sig
+
+class ExportManifest:
+    def __init__(self, out_dir: Path, hash_contents: bool = False):
+        self.path = out_dir / MANIFEST_NAME
+        self.hash_contents = hash_contents
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lines = 0
+        if self.path.exists():
+            for line in self.path.read_text(encoding="utf-8").splitlines():
+                try:
+                    entry = json.loads(line)
+                    self._entries[entry["output"]] = entry
+                    self._lines += 1
+                except (ValueError, KeyError, TypeError):
+                    continue  # a line cut short by a crash
+            if self._lines > 2 * len(self._entries) + 100:
+                self.compact()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _input_unchanged(self, recorded: Dict[str, Any], p: Path) -> bool:
+        if recorded.get("path") != str(p):
+            return False
+        try:
+            st = os.stat(p)
+        except OSError:
+            return False
+        if st.st_size != recorded.get("size"):
+            return False
+        if st.st_mtime_ns == recorded.get("mtime_ns"):
+            return True
+        # Touched but maybe not changed (copied, re-synced): only content hashes can tell.
+        return self.hash_contents and "sha256" in recorded and _sha256(p) == recorded["sha256"]
+
+    def is_current(self, job: PairJob, settings: BatchSettings) -> bool:
+        """True if ``job`` was exported with these settings from the same inputs and its outputs still exist."""
+        entry = self._entries.get(str(job.out_path))
+        if entry is None:
+            return False
+        if not all(p.exists() for p in output_paths(job.out_path, settings.output_kinds(), settings.thumb_format).values()):
+            return False
+        if entry.get("settings") != settings_signature(settings):
+            return False
+        return (self._input_unchanged(entry.get("before", {}), job.before)
+                and self._input_unchanged(entry.get("after", {}), job.after))
+
+    def pending(self, jobs: Iterable[PairJob], settings: BatchSettings) -> Tuple[List[PairJob], List[PairJob]]:
+        """Split ``jobs`` into (to export, already up to date)."""
+        todo: List[PairJob] = []; skipped: List[PairJob] = []
+        for job in jobs:
+            (skipped if self.is_current(job, settings) else todo).append(job)
+        return todo, skipped
+
+    def iter_pending(self, jobs: Iterable[PairJob], settings: BatchSettings, skipped: List[PairJob]) -> Iterator[PairJob]:
+        """Lazy form of :meth:`pending`: yields jobs to export, appending up-to-date ones to ``skipped``."""
+        for job in jobs:
+            if self.is_current(job, settings):
+                skipped.append(job)
+            else:
+                yield job
+
+    def record(self, result: PairResult, settings: BatchSettings) -> None:
+        if not result.ok or result.output is None:
+            return
+        job = result.job
+        try:
+            entry = {
+                "output": str(job.out_path),
+                "before": file_signature(job.before, self.hash_contents),
+                "after": file_signature(job.after, self.hash_contents),
+                "settings": settings_signature(settings),
+            }
+        except OSError:
+            return  # input vanished after export; next run will redo it
+        self._entries[entry["output"]] = entry
+        with open(self.path, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(entry) + "\n")
+        self._lines += 1
+
+    def compact(self) -> None:
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text("".join(json.dumps(e) + "\n" for e in self._entries.values()), encoding="utf-8")
+        os.replace(tmp, self.path)
+        self._lines = len(self._entries)
+
+    def get(self, out_path: Path) -> Optional[Dict[str, Any]]:
+        return self._entries.get(str(out_path))
@@ -0,0 +1,134 @@
+from __future__ import annotations
+import hashlib, json, os
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from .logic import SUPPORTED_EXTS, pair_role, pair_stem
+from .utils import parse_patient_from_filename
+
+# Pairing index for big and nested folders. Each directory is listed once with
+# os.scandir (no per-file stat); the listing is cached on disk together with
+# the directory's mtime, which changes whenever an entry is added, removed or
+# renamed, so rescanning an unchanged tree costs one stat per directory.
+#
+# Pairing rules per directory (guess_pairs_in_folder and the GUI batch use the
+# same ones):
+#   * X_before / X_after pairs are yielded as soon as the second half is seen,
+#     so on a fresh scan they come out in listing order; with ``ordered`` (or
+#     from the cache, where the whole listing is already known) each
+#     directory's names are taken in case-insensitive order instead, which
+#     makes the scan lazy per directory only;
+#   * leftovers are paired positionally only within the same patient (by
+#     parse_patient_from_filename), files without patient info among themselves,
+#     so one patient's photo is never paired with another's.
+
+Pair = Tuple[Path, Path, str]
+
+def _cache_path(root: Path, recursive: bool) -> Path:
+    from .config import CACHE_DIR
+    key = hashlib.sha1(f"{root}|{int(recursive)}".encode("utf-8", "surrogateescape")).hexdigest()
+    return CACHE_DIR / "pair_index" / f"{key}.json"
+
+def _load_cache(path: Path) -> Dict[str, dict]:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        return data["dirs"] if isinstance(data.get("dirs"), dict) else {}
+    except (OSError, ValueError, KeyError, AttributeError):
+        return {}
+
+def _save_cache(path: Path, root: Path, dirs: Dict[str, dict]) -> None:
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"root": str(root), "dirs": dirs}), encoding="utf-8")
+        os.replace(tmp, path)
+    except OSError:
+        pass  # the cache is only a speed-up
+
+def _pair_leftovers(leftovers: List[Path]) -> Iterator[Pair]:
+    groups: Dict[Optional[str], List[Path]] = {}
+    for p in leftovers:
+        info = parse_patient_from_filename(p.name)
+        groups.setdefault(info["id"] if info else None, []).append(p)
+    for key in sorted(groups, key=lambda k: (k is None, k or "")):
+        files = sorted(groups[key], key=lambda x: x.name.lower())
+        for i in range(0, len(files) - 1, 2):
+            yield files[i], files[i + 1], files[i].stem
+
+def _name_order(names: Iterable[str]) -> List[str]:
+    return sorted(names, key=lambda n: (n.lower(), n))
+
+def pairs_in_listing(folder: Path, names: Iterable[str]) -> Iterator[Pair]:
+    """Pair image files of one directory; ``names`` may be a live listing."""
+    halves: Dict[str, Dict[str, Path]] = {}
+    done: set = set()
+    leftovers: List[Path] = []
+    for name in names:
+        p = folder / name
+        role = pair_role(p)
+        if role is None:
+            leftovers.append(p); continue
+        key, r = role
+        v = halves.setdefault(key, {})
+        if key in done or r in v:
+            leftovers.append(p); continue
+        v[r] = p
+        if len(v) == 2:
+            done.add(key)
+            yield v["before"], v["after"], pair_stem(key)
+    leftovers += [p for key, v in halves.items() if key not in done for p in v.values()]
+    yield from _pair_leftovers(leftovers)
+
+def iter_pairs(folder: Path, recursive: bool = False, use_cache: bool = True, ordered: bool = False) -> Iterator[Pair]:
+    """Yield (before, after, stem) for ``folder`` (and its subfolders if ``recursive``) while scanning.
+
+    Directories are visited breadth-first in name order. Named pairs come out
+    as soon as both halves have been listed; with ``ordered`` each directory is
+    listed in full first and its pairs come out in name order. Hidden files are
+    ignored and hidden or symlinked subfolders are not entered. The on-disk
+    cache is only rewritten when the scan runs to completion.
+    """
+    root = Path(os.path.abspath(folder))
+    cache_file = _cache_path(root, recursive) if use_cache else None
+    cached = _load_cache(cache_file) if cache_file else {}
+    fresh: Dict[str, dict] = {}
+    changed = False
+    queue = deque([""])
+    while queue:
+        rel = queue.popleft()
+        path = root / rel if rel else root
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            changed = True; continue
+        entry = cached.get(rel)
+        if entry is not None and entry.get("mtime_ns") == mtime:
+            yield from pairs_in_listing(path, _name_order(entry["files"]))
+        else:
+            entry = {"mtime_ns": mtime, "files": [], "dirs": []}
+            changed = True
+            names = _scan(path, entry)
+            yield from pairs_in_listing(path, _name_order(names) if ordered else names)
+        fresh[rel] = entry
+        if recursive:
+            queue.extend(f"{rel}/{d}" if rel else d for d in sorted(entry["dirs"]))
+    if cache_file and (changed or len(fresh) != len(cached)):
+        _save_cache(cache_file, root, fresh)
+
+def _scan(path: Path, entry: dict) -> Iterator[str]:
+    """Yield supported image names in ``path``, recording them and the subfolders in ``entry``."""
+    try:
+        with os.scandir(path) as it:
+            for e in it:
+                if e.name.startswith("."):
+                    continue
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        entry["dirs"].append(e.name)
+                    elif os.path.splitext(e.name)[1].lower() in SUPPORTED_EXTS and e.is_file():
+                        entry["files"].append(e.name)
+                        yield e.name
+                except OSError:
+                    continue
+    except OSError:
+        entry["mtime_ns"] = None  # unreadable: don't let the cache remember it as empty
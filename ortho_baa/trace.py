@@ -0,0 +1,183 @@
+from __future__ import annotations
+import json, os, threading, time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Timing spans around the pipeline stages:
+#
+#     with trace.span("decode", file=p.name):
+#         ...
+#
+# Finished spans are handed to every installed sink as a dict. With no sink
+# installed, span() returns a shared no-op object, so the cost of an
+# instrumented call is one function call and a list check.
+
+Sink = Callable[[Dict[str, Any]], None]
+TRACE_ENV = "ORTHO_BAA_TRACE"  # "1" for the default log, or a file path
+
+_sinks: List[Sink] = []  # replaced, never mutated, so emitting needs no lock
+_local = threading.local()
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoSpan":
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+    def set(self, **attrs: Any) -> None:
+        pass
+
+_NO_SPAN = _NoSpan()
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "children", "parent")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name, self.attrs = name, attrs
+        self.children = 0.0  # time spent in nested spans, for self time
+        self.parent: Optional[Span] = None
+        self.start = 0.0
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent = stack[-1] if stack else None
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        dur = time.perf_counter() - self.start
+        stack = _local.stack
+        stack.pop()
+        if self.parent is not None:
+            self.parent.children += dur
+        # Children run on other threads (see in_context) can overlap, so self time is clamped at zero.
+        event = {"name": self.name, "ts": round(time.time() - dur, 6), "dur": dur, "self": max(0.0, dur - self.children),
+                 "parent": self.parent.name if self.parent else None, "depth": len(stack),
+                 "pid": os.getpid(), "thread": threading.current_thread().name, **self.attrs}
+        if exc_type is not None:
+            event["error"] = exc_type.__name__
+        for sink in _sinks:
+            try:
+                sink(event)
+            except Exception:
+                pass  # a broken sink must never break an export
+        return False
+
+def span(name: str, **attrs: Any):
+    if not _sinks:
+        return _NO_SPAN
+    return Span(name, attrs)
+
+def current() -> Optional[Span]:
+    stack = getattr(_local, "stack", None)
+    return stack[-1] if stack else None
+
+def in_context(fn: Callable) -> Callable:
+    """``fn`` wrapped so spans it opens on another thread nest under the caller's current span."""
+    parent = current()
+    if parent is None:
+        return fn
+
+    def run(*args, **kwargs):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            stack.pop()
+    return run
+
+def enabled() -> bool:
+    return bool(_sinks)
+
+def add_sink(sink: Sink) -> None:
+    global _sinks
+    _sinks = _sinks + [sink]
+
+def remove_sink(sink: Sink) -> None:
+    global _sinks
+    _sinks = [s for s in _sinks if s is not sink]
+
+class JsonlSink:
+    """Appends one JSON object per span to ``path``."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fh = open(self.path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Dict[str, Any]) -> None:
+        line = json.dumps(event, default=str) + "\n"
+        with self._lock:
+            self._fh.write(line)
+            self._fh.flush()  # one write per line, so worker processes appending to the same file don't interleave
+
+    def close(self) -> None:
+        with self._lock:
+            self._fh.close()
+
+class Collector:
+    """Keeps spans in memory, e.g. for the timing breakdown of one Save."""
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+
+    def __call__(self, event: Dict[str, Any]) -> None:
+        self.events.append(event)  # list.append is atomic; spans can end on any thread
+
+    def breakdown(self) -> Dict[str, float]:
+        """Self time per span name, largest first; nested spans aren't counted twice."""
+        totals: Dict[str, float] = {}
+        for e in self.events:
+            totals[e["name"]] = totals.get(e["name"], 0.0) + e["self"]
+        return dict(sorted(totals.items(), key=lambda kv: -kv[1]))
+
+@contextmanager
+def collect() -> Iterator[Collector]:
+    c = Collector()
+    add_sink(c)
+    try:
+        yield c
+    finally:
+        remove_sink(c)
+
+def format_breakdown(totals: Dict[str, float], limit: int = 5) -> str:
+    parts = [f"{name} {secs:.2f} s" for name, secs in list(totals.items())[:limit] if secs >= 0.005]
+    return " · ".join(parts)
+
+def default_log_path() -> Path:
+    from .config import APP_DIR
+    return APP_DIR / "trace.jsonl"
+
+def install_log_sink(cfg: Optional[Dict[str, Any]] = None, path: Optional[str] = None) -> Optional[JsonlSink]:
+    """Install the JSON-lines sink if asked for by ``path``, $ORTHO_BAA_TRACE or the ``trace_log`` config key."""
+    target = path if path is not None else os.environ.get(TRACE_ENV)
+    if target is None and cfg and cfg.get("trace_log"):
+        target = ""
+    if target is None or target == "0":
+        return None
+    sink = JsonlSink(Path(target) if target not in ("", "1") else default_log_path())
+    add_sink(sink)
+    return sink
+
+def log_paths() -> List[Path]:
+    """Files the installed JSON-lines sinks write to (handed to worker processes)."""
+    return [s.path for s in _sinks if isinstance(s, JsonlSink)]
+
+def install_worker_sinks(paths: List[Path]) -> None:
+    """Process-pool initializer: spawned workers start without sinks, so log to the parent's files."""
+    for path in paths:
+        add_sink(JsonlSink(path))
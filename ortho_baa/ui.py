@@ -1,17 +1,19 @@
 from __future__ import annotations
+import threading
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, List, Optional, Tuple
 from PIL import Image
 
-from PySide6.QtCore import Qt, Signal, QUrl
-from PySide6.QtGui import QPixmap, QImage, QIcon, QDesktopServices
+from PySide6.QtCore import Qt, Signal, QUrl, QObject, QRectF, QRunnable, QThreadPool, QTimer
+from PySide6.QtGui import QPixmap, QImage, QIcon, QDesktopServices, QPainter, QColor, QTransform
 from PySide6.QtWidgets import (
     QWidget, QMainWindow, QLabel, QPushButton, QVBoxLayout, QHBoxLayout,
     QFileDialog, QGroupBox, QLineEdit, QMessageBox, QFrame, QCheckBox, QSpinBox,
-    QComboBox, QStatusBar, QProgressBar, QDialog, QScrollArea
+    QComboBox, QStatusBar, QProgressBar, QDialog, QGraphicsItem, QGraphicsScene, QGraphicsView, QStyleOptionGraphicsItem
 )
 
-from .utils import to_rgba
+from .cache import RenderCache
+from .utils import resize_for_display
 from .resources import find_icon_path
 
 APP_STYLES = '''
@@ -22,15 +24,135 @@ QLineEdit, QComboBox, QPushButton { border: 1px solid #bbb; border-radius: 6px;
 QPushButton:pressed { padding-top: 5px; padding-bottom: 3px; }
 '''
 
-def qpix_from_pil(img: Image.Image, max_w: int, max_h: int) -> QPixmap:
-    im = to_rgba(img)
-    w, h = im.size
+THUMB_W, THUMB_H = 520, 360
+PROXY_MAX = 2048      # longest side of the in-memory proxy used for interactive crop
+REFRESH_DELAY_MS = 40  # coalesces spinbox auto-repeat into one thumbnail refresh
+PREVIEW_W, PREVIEW_H = 1400, 900
+TILE = 256            # preview tiles are TILE x TILE px of one pyramid level
+TILE_CACHE_MB = 48
+MAX_ZOOM = 8.0        # screen px per composite px
+
+# PIL mode -> (raw mode to pack as, QImage format, bytes per pixel). Pillow keeps RGB as 32-bit pixels, so
+# packing to RGBX is a plain copy. Pillow's BGRX/XRGB packers write a 0x00 pad byte, which Format_RGB32
+# (0xffRRGGBB) doesn't allow and painter.drawImage on preview tiles would see; RGBX pads with 0xff.
+_QT_FORMATS = {
+    "RGB": ("RGBX", QImage.Format_RGBX8888, 4),
+    "RGBA": ("RGBA", QImage.Format_RGBA8888, 4),
+    "L": ("L", QImage.Format_Grayscale8, 1),
+}
+
+def qimage_view(im: Image.Image) -> QImage:
+    """A QImage over one packed copy of ``im``'s pixels (no RGBA expansion for RGB or L)."""
+    if im.mode not in _QT_FORMATS:
+        im = im.convert("RGBA")
+    raw, fmt, bpp = _QT_FORMATS[im.mode]
+    data = im.tobytes("raw", raw)
+    q = QImage(data, im.width, im.height, im.width * bpp, fmt)
+    q._pixels = data  # QImage doesn't own the buffer; it has to live as long as the image
+    return q
+
+def qimage_from_pil(img: Image.Image, max_w: int, max_h: int) -> QImage:
+    # Safe off the GUI thread (QPixmap is not).
+    w, h = img.size
     scale = min(max_w / max(w, 1), max_h / max(h, 1), 1.0)
     new_w, new_h = max(1, int(w * scale)), max(1, int(h * scale))
-    im = im.resize((new_w, new_h), Image.LANCZOS)
-    data = im.tobytes("raw", "RGBA")
-    qimg = QImage(data, im.size[0], im.size[1], QImage.Format_RGBA8888)
-    return QPixmap.fromImage(qimg)
+    return qimage_view(resize_for_display(img, (new_w, new_h)))
+
+def qpix_from_pil(img: Image.Image, max_w: int, max_h: int) -> QPixmap:
+    return QPixmap.fromImage(qimage_from_pil(img, max_w, max_h))
+
+def make_proxy(img: Image.Image, max_side: int = PROXY_MAX) -> tuple[Image.Image, float]:
+    """Screen-sized copy of ``img`` and its scale relative to the original."""
+    w, h = img.size
+    s = min(max_side / max(w, h, 1), 1.0)
+    if s == 1.0:
+        return img, 1.0
+    proxy = resize_for_display(img, (max(1, round(w * s)), max(1, round(h * s))), reducing_gap=3.0)
+    return proxy, proxy.height / h
+
+class _LoadSignals(QObject):
+    preview = Signal(int, object, object)  # generation, thumbnail from the file's embedded preview, crop used
+    finished = Signal(int, object, object, object, object)  # generation, path, (full image or None, proxy, scale) or None, thumbnail, crop used
+
+class _LoadTask(QRunnable):
+    """Renders a pane thumbnail on a QThreadPool worker, without decoding the full frame if it can avoid it.
+
+    A proxy from the on-disk cache is used as is. Otherwise the embedded thumbnail
+    (EXIF/HEIF) is shown first, if the file has one; then a draft decode (JPEG DCT
+    scaling, HEIF thumbnails) provides the proxy for crop previews, which is cached
+    for next time. Formats that can only be decoded in full hand back the full image too.
+    """
+
+    def __init__(self, generation: int, path: Path, crop, proxy_cache=None):
+        super().__init__()
+        self.generation, self.path, self.crop = generation, path, crop
+        self.proxy_cache = proxy_cache
+        self.signals = _LoadSignals()
+
+    def _thumb(self, proxy: Image.Image, s: float) -> QImage:
+        from .logic import crop_top_then_bottom, scale_params
+        return qimage_from_pil(crop_top_then_bottom(proxy, scale_params(self.crop, s)), THUMB_W, THUMB_H)
+
+    def run(self):
+        from .logic import embedded_thumbnail, load_image_draft
+        from .cache import proxy_key
+        loaded = thumb = None
+        source = proxy_key(self.path, PROXY_MAX) if self.proxy_cache is not None else None
+        if source is not None:
+            cached = self.proxy_cache.get(source[0])
+            if cached is not None:
+                s = cached.height / source[1][1]
+                self.signals.finished.emit(self.generation, self.path, (None, cached, s), self._thumb(cached, s), self.crop)
+                return
+        try:
+            quick = embedded_thumbnail(self.path, (THUMB_W // 2, THUMB_H // 2))
+            if quick is not None:
+                small, full = quick
+                self.signals.preview.emit(self.generation, self._thumb(small, small.height / full[1]), self.crop)
+            res = load_image_draft(self.path, PROXY_MAX)
+            if res is not None:
+                im, full = res
+                proxy, _ = make_proxy(im)
+                s = proxy.height / full[1]
+                thumb = self._thumb(proxy, s)
+                loaded = (im if im.size == full else None, proxy, s)
+        except Exception:
+            loaded = None
+        self.signals.finished.emit(self.generation, self.path, loaded, thumb, self.crop)
+        if loaded is not None and source is not None and loaded[1] is not loaded[0]:
+            self.proxy_cache.put(source[0], loaded[1])  # after the pane has its image; small frames aren't worth it
+
+class _JobSignals(QObject):
+    progress = Signal(int, str)  # percent, status text ("" keeps the current message)
+    done = Signal(object)  # the job function's return value
+    failed = Signal(str)
+
+class BackgroundJob(QRunnable):
+    """Runs ``fn(job)`` off the GUI thread; ``fn`` reports through job.report() and checks job.cancelled."""
+
+    def __init__(self, fn: Callable[["BackgroundJob"], Any]):
+        super().__init__()
+        self.fn = fn
+        self.signals = _JobSignals()
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    def report(self, percent: int, text: str = "") -> None:
+        self.signals.progress.emit(percent, text)
+
+    def run(self):
+        try:
+            res = self.fn(self)
+        except Exception as e:
+            self.signals.failed.emit(str(e) or type(e).__name__)
+        else:
+            self.signals.done.emit(res)
 
 class DropPane(QFrame):
     pathChanged = Signal(str)
@@ -43,7 +165,13 @@ class DropPane(QFrame):
         self.setFrameShape(QFrame.StyledPanel)
 
         self._path: Optional[Path] = None
-        self._pil: Optional[Image.Image] = None
+        self._pil: Optional[Image.Image] = None  # full resolution; decoded on first use, see full_image
+        self._full_lock = threading.Lock()
+        self._proxy: Optional[Image.Image] = None  # display-only copy of _pil, see make_proxy
+        self._proxy_scale = 1.0
+        self._load_gen = 0  # bumped per set_path/clear; older load results are dropped
+        self._loading: Optional[_LoadTask] = None
+        self.proxy_cache = None  # cache.ProxyCache shared by the panes; set by the app
 
         self.title = QLabel(title); self.title.setAlignment(Qt.AlignCenter); self.title.setStyleSheet("font-weight:600;")
         self.thumb = QLabel("Drop image here"); self.thumb.setAlignment(Qt.AlignCenter); self.thumb.setMinimumHeight(220)
@@ -67,8 +195,10 @@ class DropPane(QFrame):
         self.choose_btn.clicked.connect(self.choose_file)
         self.clear_btn.clicked.connect(self.clear)
         self.crop_check.toggled.connect(self._update_crop_state)
-        self.top_spin.valueChanged.connect(self._refresh_preview)
-        self.bottom_spin.valueChanged.connect(self._refresh_preview)
+        self._refresh_timer = QTimer(self); self._refresh_timer.setSingleShot(True); self._refresh_timer.setInterval(REFRESH_DELAY_MS)
+        self._refresh_timer.timeout.connect(self._refresh_preview)
+        self.top_spin.valueChanged.connect(lambda _: self._refresh_timer.start())
+        self.bottom_spin.valueChanged.connect(lambda _: self._refresh_timer.start())
         self._update_crop_state()
 
     @property
@@ -86,7 +216,8 @@ class DropPane(QFrame):
             self.set_path(Path(p))
 
     def clear(self):
-        self._path = None; self._pil = None
+        self._load_gen += 1; self._loading = None
+        self._path = None; self._pil = None; self._proxy = None
         self.thumb.setText("Drop image here")
         self.pathChanged.emit(""); self.imageChanged.emit()
 
@@ -104,27 +235,74 @@ class DropPane(QFrame):
             if p.exists() and p.is_file():
                 self.set_path(p); break
 
+    @property
+    def is_loading(self) -> bool:
+        return self._loading is not None
+
     def set_path(self, p: Path):
-        from .logic import load_image
-        im = load_image(p)
-        if im is None:
+        self._load_gen += 1
+        task = _LoadTask(self._load_gen, p, self.crop_params(), self.proxy_cache)
+        task.signals.preview.connect(self._on_preview)
+        task.signals.finished.connect(self._on_loaded)
+        self._loading = task
+        self.thumb.setText(f"Loading {p.name}…")
+        QThreadPool.globalInstance().start(task)
+
+    def _on_preview(self, generation: int, thumb: QImage, crop):
+        if generation == self._load_gen and self._loading is not None and crop == self.crop_params():
+            self.thumb.setPixmap(QPixmap.fromImage(thumb))
+
+    def _on_loaded(self, generation: int, p: Path, loaded, thumb: Optional[QImage], crop):
+        if generation != self._load_gen:
+            return  # another file was dropped (or the pane cleared) meanwhile
+        self._loading = None
+        if loaded is None:
+            self._refresh_preview()
             QMessageBox.warning(self, "Invalid image", f"Could not load:\n{p}")
             return
-        self._path = p; self._pil = im
-        self._refresh_preview()
+        self._path = p
+        self._pil, self._proxy, self._proxy_scale = loaded
+        if crop == self.crop_params():
+            self.thumb.setPixmap(QPixmap.fromImage(thumb))
+        else:
+            self._refresh_preview()  # crop settings changed while loading
         self.pathChanged.emit(str(p)); self.imageChanged.emit()
 
+    def crop_params(self):
+        from .logic import CropParams
+        return CropParams(self.crop_check.isChecked(), self.top_spin.value(), self.bottom_spin.value())
+
+    def full_image(self) -> Optional[Image.Image]:
+        """The full-resolution frame. Decoded on first call (export time), from any thread."""
+        from .logic import load_image
+        with self._full_lock:
+            path = self._path
+            if self._pil is None and path is not None:
+                im = load_image(path)
+                if path != self._path:
+                    return None  # another file was loaded meanwhile
+                self._pil = im
+            return self._pil
+
     def get_effective_image(self) -> Optional[Image.Image]:
-        from .logic import crop_top_then_bottom, CropParams
-        if self._pil is None: return None
-        if self.crop_check.isChecked():
-            return crop_top_then_bottom(self._pil, CropParams(True, self.top_spin.value(), self.bottom_spin.value()))
-        return self._pil
+        # Full resolution; only called at export time.
+        from .logic import crop_top_then_bottom
+        im = self.full_image()
+        if im is None: return None
+        return crop_top_then_bottom(im, self.crop_params())
+
+    def get_display_image(self) -> Optional[Image.Image]:
+        from .logic import crop_top_then_bottom, scale_params
+        if self._proxy is None: return None
+        return crop_top_then_bottom(self._proxy, scale_params(self.crop_params(), self._proxy_scale))
 
     def _refresh_preview(self):
-        eff = self.get_effective_image()
+        self._refresh_timer.stop()
+        if self._loading is not None:
+            return  # _on_loaded repaints once the decode finishes
+        eff = self.get_display_image()
         if eff is None: self.thumb.setText("Drop image here")
-        else: self.thumb.setPixmap(qpix_from_pil(eff, 520, 360))
+        else: self.thumb.setPixmap(qpix_from_pil(eff, THUMB_W, THUMB_H))
         self.imageChanged.emit()
 
     def _update_crop_state(self):
@@ -132,6 +310,127 @@ class DropPane(QFrame):
         self.top_spin.setEnabled(enabled); self.bottom_spin.setEnabled(enabled)
         self._refresh_preview()
 
+# ---------------- Zoomable preview ----------------
+
+def build_pyramid(img: Image.Image) -> List[Image.Image]:
+    """``img`` followed by 2x box-reduced copies, down to one tile."""
+    levels = [img]
+    while max(levels[-1].size) > TILE:
+        levels.append(levels[-1].reduce(2))
+    return levels
+
+class _PyramidSignals(QObject):
+    ready = Signal(int, object)  # generation, levels
+
+class _PyramidTask(QRunnable):
+    def __init__(self, generation: int, img: Image.Image):
+        super().__init__()
+        self.generation, self.img = generation, img
+        self.signals = _PyramidSignals()
+
+    def run(self):
+        self.signals.ready.emit(self.generation, build_pyramid(self.img))
+
+class _PyramidItem(QGraphicsItem):
+    """Draws the pyramid level that matches the view's zoom, one cached tile at a time.
+
+    Scene coordinates are composite pixels (``size``) whatever the resolution of
+    the image behind the pyramid, so a screen-sized render can be swapped for the
+    full-resolution one without moving the view.
+    """
+
+    def __init__(self, tiles: RenderCache):
+        super().__init__()
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)  # exposedRect = the part being repainted
+        self.tiles = tiles
+        self.levels: List[Image.Image] = []
+        self.size: Tuple[int, int] = (1, 1)
+        self.generation = 0
+
+    def boundingRect(self) -> QRectF:
+        return QRectF(0, 0, *self.size)
+
+    def set_levels(self, levels: List[Image.Image], size: Tuple[int, int], generation: int) -> None:
+        self.prepareGeometryChange()
+        self.levels, self.size, self.generation = levels, size, generation
+        self.tiles.clear()
+        self.update()
+
+    def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem, widget=None) -> None:
+        if not self.levels:
+            return
+        zoom = painter.worldTransform().m11()  # screen px per scene px
+        level = 0  # the coarsest level that still has a pixel per screen pixel
+        for i, im in enumerate(self.levels):
+            if im.width / self.size[0] < zoom:
+                break
+            level = i
+        im = self.levels[level]
+        f = self.size[0] / im.width  # scene px per level px
+        r = option.exposedRect
+        tx0, ty0 = max(0, int(r.left() / f) // TILE), max(0, int(r.top() / f) // TILE)
+        tx1, ty1 = min((im.width - 1) // TILE, int(r.right() / f) // TILE), min((im.height - 1) // TILE, int(r.bottom() / f) // TILE)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                box = (tx * TILE, ty * TILE, min(im.width, (tx + 1) * TILE), min(im.height, (ty + 1) * TILE))
+                key = (self.generation, level, tx, ty)
+                tile = self.tiles.get(key)
+                if tile is None:
+                    tile = qimage_view(im.crop(box))
+                    self.tiles.put(key, tile, tile.sizeInBytes())
+                painter.drawImage(QRectF(box[0] * f, box[1] * f, (box[2] - box[0]) * f, (box[3] - box[1]) * f), tile)
+
+class PreviewView(QGraphicsView):
+    """Wheel to zoom, drag to pan. The pyramid for each new image is built on a worker thread."""
+    detailNeeded = Signal()  # zoomed in past the resolution of a screen-sized render
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setScene(QGraphicsScene(self))
+        self.item = _PyramidItem(RenderCache(TILE_CACHE_MB * 1024 ** 2))
+        self.scene().addItem(self.item)
+        self.setDragMode(QGraphicsView.ScrollHandDrag)
+        self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
+        self.setBackgroundBrush(QColor(96, 96, 96))
+        self._gen = 0
+        self._building: Optional[_PyramidTask] = None
+        self._full = False
+
+    def set_image(self, img: Image.Image, scene_size: Tuple[int, int], full: bool, fit: bool) -> None:
+        self._gen += 1
+        task = _PyramidTask(self._gen, img)
+        task.signals.ready.connect(lambda gen, levels: self._on_pyramid(gen, levels, scene_size, full, fit))
+        self._building = task
+        QThreadPool.globalInstance().start(task)
+
+    def _on_pyramid(self, gen: int, levels: List[Image.Image], scene_size: Tuple[int, int], full: bool, fit: bool) -> None:
+        if gen != self._gen:
+            return  # a newer image is on its way
+        self._building = None
+        self.item.set_levels(levels, scene_size, gen)
+        self.scene().setSceneRect(self.item.boundingRect())
+        self._full = full
+        if fit:
+            self.fit()
+
+    def fit(self) -> None:
+        self.fitInView(self.item, Qt.KeepAspectRatio)
+
+    def fit_zoom(self) -> float:
+        w, h = self.item.size
+        return min(self.viewport().width() / w, self.viewport().height() / h)
+
+    def zoom_to(self, zoom: float) -> None:
+        zoom = max(self.fit_zoom() / 2, min(MAX_ZOOM, zoom))
+        self.setTransform(QTransform.fromScale(zoom, zoom))
+        levels = self.item.levels
+        if not self._full and levels and zoom * self.item.size[0] > levels[0].width:
+            self.detailNeeded.emit()
+
+    def wheelEvent(self, e):
+        self.zoom_to(self.transform().m11() * 1.25 ** (e.angleDelta().y() / 120))
+
 def make_window_icon() -> QIcon:
     try:
         p = find_icon_path()
@@ -144,7 +443,9 @@ def make_window_icon() -> QIcon:
 class MainWindow(QMainWindow):
     saveRequested = Signal()
     previewRequested = Signal()
+    previewZoomRequested = Signal(bool)  # True: the preview was zoomed in and needs the full-resolution render
     batchRequested = Signal()
+    cancelRequested = Signal()
 
     def __init__(self, out_dir_default: Path, output_format_default: str = "PDF"):
         super().__init__()
@@ -172,9 +473,18 @@ class MainWindow(QMainWindow):
         self.name_id_cb = QCheckBox("ID"); self.name_first_cb = QCheckBox("First"); self.name_last_cb = QCheckBox("Last")
         parts_row = QHBoxLayout(parts_group); parts_row.addWidget(self.name_id_cb); parts_row.addWidget(self.name_first_cb); parts_row.addWidget(self.name_last_cb); parts_row.addStretch(1)
 
-        out_lay = QVBoxLayout(out_group); out_lay.addLayout(r1); out_lay.addLayout(r2); out_lay.addWidget(parts_group)
+        # Extra files written next to the main output from the same decode (see exporters.export_outputs).
+        self.also_cbs = {"PDF": QCheckBox("PDF"), "JPEG": QCheckBox("JPEG"), "THUMB": QCheckBox("Thumbnail")}
+        also_row = QHBoxLayout(); also_row.addWidget(QLabel("Also save:"))
+        for cb in self.also_cbs.values(): also_row.addWidget(cb)
+        also_row.addStretch(1)
+        self.format_combo.currentTextChanged.connect(self._update_also_state); self._update_also_state()
+
+        out_lay = QVBoxLayout(out_group); out_lay.addLayout(r1); out_lay.addLayout(r2); out_lay.addLayout(also_row); out_lay.addWidget(parts_group)
 
-        batch_row = QHBoxLayout(); self.batch_btn = QPushButton("Batch: Choose folder…"); batch_row.addStretch(1); batch_row.addWidget(self.batch_btn)
+        batch_row = QHBoxLayout(); self.batch_btn = QPushButton("Batch: Choose folder…")
+        self.batch_single_cb = QCheckBox("One PDF for the whole batch")
+        batch_row.addStretch(1); batch_row.addWidget(self.batch_single_cb); batch_row.addWidget(self.batch_btn)
 
         panes = QHBoxLayout(); panes.addWidget(self.before, 1); panes.addWidget(self.after, 1)
         central = QWidget(); main = QVBoxLayout(central); main.addLayout(panes, 1); main.addWidget(out_group); main.addLayout(batch_row)
@@ -183,6 +493,9 @@ class MainWindow(QMainWindow):
         self.status = QStatusBar(); self.setStatusBar(self.status)
         self.progress = QProgressBar(); self.progress.setRange(0, 100); self.progress.setValue(0); self.progress.setFixedWidth(200)
         self.status.addPermanentWidget(self.progress)
+        self.cancel_btn = QPushButton("Cancel"); self.cancel_btn.hide()
+        self.status.addPermanentWidget(self.cancel_btn)
+        self.cancel_btn.clicked.connect(self.cancelRequested.emit)
 
         self.open_folder_btn = QPushButton("Go to folder"); self.open_folder_btn.setEnabled(False)
         self.status.addPermanentWidget(self.open_folder_btn)
@@ -193,23 +506,45 @@ class MainWindow(QMainWindow):
         self.batch_btn.clicked.connect(self.batchRequested.emit)
         self._preview_dialog: QDialog | None = None
 
-    def show_preview(self, img: Image.Image) -> None:
+    def _update_also_state(self, *_):
+        for kind, cb in self.also_cbs.items():
+            cb.setEnabled(kind != self.format_combo.currentText())  # the main format is always written
+
+    def extra_outputs(self) -> tuple[str, ...]:
+        return tuple(k for k, cb in self.also_cbs.items() if cb.isChecked() and cb.isEnabled())
+
+    def set_busy(self, busy: bool) -> None:
+        """Lock the inputs while a save or batch runs in the background; Cancel shows instead."""
+        for w in (self.before, self.after, self.save_btn, self.preview_btn, self.batch_btn, self.batch_single_cb, self.format_combo):
+            w.setEnabled(not busy)
+        self.cancel_btn.setVisible(busy); self.cancel_btn.setEnabled(True)
+
+    def show_preview(self, img: Image.Image, full_size: bool = False, canvas_size: Optional[Tuple[int, int]] = None) -> None:
+        """Show ``img``, a render of the ``canvas_size`` composite, in the zoomable preview.
+
+        A screen-sized render (see exporters.render_preview) opens fitted to the window;
+        zooming in past its resolution emits previewZoomRequested(True), and the
+        full-resolution render then replaces it in place (``full_size``).
+        """
         if self._preview_dialog is None:
             dlg = QDialog(self)
             dlg.setWindowTitle("Preview")
             dlg.setMinimumSize(900, 700)
             dlg_layout = QVBoxLayout(dlg)
-            scroll = QScrollArea()
-            scroll.setWidgetResizable(True)
-            img_label = QLabel()
-            img_label.setAlignment(Qt.AlignCenter)
-            scroll.setWidget(img_label)
-            dlg_layout.addWidget(scroll)
-            dlg._img_label = img_label  # type: ignore[attr-defined]
+            view = PreviewView(dlg)
+            view.detailNeeded.connect(lambda: self.previewZoomRequested.emit(True))
+            fit_btn = QPushButton("Fit"); fit_btn.clicked.connect(view.fit)
+            actual_btn = QPushButton("100%"); actual_btn.clicked.connect(lambda: view.zoom_to(1.0))
+            zoom_row = QHBoxLayout(); zoom_row.addWidget(QLabel("Scroll to zoom, drag to pan.")); zoom_row.addStretch(1)
+            zoom_row.addWidget(fit_btn); zoom_row.addWidget(actual_btn)
+            dlg_layout.addLayout(zoom_row)
+            dlg_layout.addWidget(view, 1)
+            dlg.resize(PREVIEW_W, PREVIEW_H)
+            dlg._view = view  # type: ignore[attr-defined]
             self._preview_dialog = dlg
 
-        label = self._preview_dialog._img_label  # type: ignore[attr-defined]
-        label.setPixmap(qpix_from_pil(img, 1400, 900))
+        view = self._preview_dialog._view  # type: ignore[attr-defined]
+        view.set_image(img, canvas_size or img.size, full=full_size, fit=not full_size)
         self._preview_dialog.show()
         self._preview_dialog.raise_()
         self._preview_dialog.activateWindow()
@@ -1,6 +1,6 @@
 from __future__ import annotations
 from pathlib import Path
-from typing import Tuple
+from typing import Optional, Tuple
 from PIL import Image
 import re
 
@@ -13,6 +13,26 @@ def fit_rect(w: float, h: float, box_w: float, box_h: float) -> Tuple[float, flo
 def to_rgba(img: Image.Image) -> Image.Image:
     return img if img.mode in ("RGB", "RGBA") else img.convert("RGBA")
 
+def to_rgb(img: Image.Image) -> Image.Image:
+    # convert() copies even when the mode already matches
+    return img if img.mode == "RGB" else img.convert("RGB")
+
+def resize_rgb(img: Image.Image, size: Tuple[int, int], reducing_gap: Optional[float] = None) -> Image.Image:
+    """Same pixels as ``img.convert("RGB").resize(size, LANCZOS)`` with fewer full-size copies."""
+    if img.size == tuple(size):
+        return to_rgb(img)
+    if img.mode == "L":
+        # L -> RGB only replicates the channel, so converting the small result is identical.
+        return img.resize(size, Image.LANCZOS, reducing_gap=reducing_gap).convert("RGB")
+    return to_rgb(img).resize(size, Image.LANCZOS, reducing_gap=reducing_gap)
+
+def resize_for_display(img: Image.Image, size: Tuple[int, int], reducing_gap: Optional[float] = None) -> Image.Image:
+    """Resize for on-screen use. RGB, RGBA and L are kept as they are; other modes become RGBA, after shrinking where safe."""
+    if img.mode in ("RGB", "RGBA", "L", "LA"):
+        im = img if img.size == tuple(size) else img.resize(size, Image.LANCZOS, reducing_gap=reducing_gap)
+        return im.convert("RGBA") if im.mode == "LA" else im
+    return to_rgba(img).resize(size, Image.LANCZOS, reducing_gap=reducing_gap)
+
 def ensure_dir(p: Path) -> Path:
     p.mkdir(parents=True, exist_ok=True)
     return p
@@ -0,0 +1,217 @@
+from __future__ import annotations
+import ctypes, ctypes.util, os, select, struct, sys, threading, time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from .logic import SUPPORTED_EXTS, pair_role, pair_stem
+from .batch import BatchSettings, PairJob, PairResult, FORMAT_SUFFIX, export_pair
+from .manifest import ExportManifest
+
+# Watch mode: export before/after pairs as their files land in a folder.
+# Only explicitly named pairs (X_before / X_after) are handled; the positional
+# fallback of guess_pairs_in_folder needs the complete folder and can't work
+# on files that trickle in.
+
+class InotifyBackend:
+    """Linux inotify through libc (no extra dependency). Reports names written or moved into the folder."""
+
+    IN_ATTRIB, IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE, IN_Q_OVERFLOW = 0x4, 0x8, 0x80, 0x100, 0x4000
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, folder: Path):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # No IN_MODIFY: one event per write fills the queue, and close-write plus the settle check cover it.
+        mask = self.IN_ATTRIB | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if libc.inotify_add_watch(self._fd, os.fsencode(str(folder)), mask) < 0:
+            err = ctypes.get_errno(); os.close(self._fd)
+            raise OSError(err, f"inotify_add_watch failed for {folder}")
+
+    def read(self, timeout: float) -> Optional[Set[str]]:
+        """Names changed within ``timeout`` seconds, or None if the kernel queue overflowed and events were lost."""
+        names: Set[str] = set()
+        overflowed = False
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return names
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return names
+        i = 0
+        while i + self._EVENT.size <= len(data):
+            _wd, mask, _cookie, length = self._EVENT.unpack_from(data, i)
+            i += self._EVENT.size
+            name = data[i:i + length].rstrip(b"\0")
+            i += length
+            overflowed |= bool(mask & self.IN_Q_OVERFLOW)
+            if name:
+                names.add(os.fsdecode(name))
+        return None if overflowed else names
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+class PollingBackend:
+    """Portable fallback. Stats the known files on every poll, and re-lists the folder when its mtime changes
+    (a file was added, renamed or removed)."""
+
+    def __init__(self, folder: Path):
+        self.folder = folder
+        self._dir_mtime = -1
+        self._seen: Dict[str, Tuple[int, int]] = {}
+        self._scan()  # baseline; only later changes are reported
+
+    def read(self, timeout: float) -> Set[str]:
+        time.sleep(timeout)
+        return self._scan()
+
+    def _scan(self) -> Set[str]:
+        try:
+            mtime = os.stat(self.folder).st_mtime_ns
+        except OSError:
+            return set()
+        if mtime == self._dir_mtime:
+            return self._restat()
+        self._dir_mtime = mtime
+        changed: Set[str] = set()
+        seen: Dict[str, Tuple[int, int]] = {}
+        with os.scandir(self.folder) as it:
+            for e in it:
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue
+                sig = (st.st_size, st.st_mtime_ns)
+                seen[e.name] = sig
+                if self._seen.get(e.name) != sig:
+                    changed.add(e.name)
+        self._seen = seen
+        return changed
+
+    def _restat(self) -> Set[str]:
+        """Files rewritten in place: the folder's mtime doesn't move, so compare each file's own size/mtime."""
+        changed: Set[str] = set()
+        for name, old in list(self._seen.items()):
+            try:
+                st = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue  # removal changes the folder's mtime; the next listing drops it
+            sig = (st.st_size, st.st_mtime_ns)
+            if sig != old:
+                self._seen[name] = sig
+                changed.add(name)
+        return changed
+
+    def close(self) -> None:
+        pass
+
+def make_backend(folder: Path, kind: str = "auto"):
+    if kind in ("auto", "inotify"):
+        try:
+            return InotifyBackend(folder)
+        except (OSError, AttributeError):
+            if kind == "inotify":
+                raise
+    return PollingBackend(folder)
+
+class FolderWatcher:
+    """Exports each before/after pair once both files exist and have stopped changing.
+
+    A file counts as fully written once its size and mtime have been stable for
+    ``settle`` seconds. Pairs the output folder's manifest already has up to date
+    are skipped; a pair is re-exported when either half is rewritten.
+    """
+
+    def __init__(self, folder: Path, out_dir: Path, settings: BatchSettings, settle: float = 2.0,
+                 poll_interval: float = 1.0, backend: str = "auto", manifest: Optional[ExportManifest] = None,
+                 on_result: Optional[Callable[[PairResult], None]] = None):
+        self.folder, self.out_dir, self.settings = folder, out_dir, settings
+        self.settle, self.poll_interval = settle, poll_interval
+        self.manifest = manifest
+        self.on_result = on_result
+        self.backend_kind = backend
+        self._pending: Dict[str, Tuple[Tuple[int, int], float]] = {}  # name -> ((size, mtime_ns), unchanged since)
+        self._halves: Dict[str, Dict[str, Path]] = {}
+
+    def _job(self, key: str) -> Optional[PairJob]:
+        v = self._halves.get(key, {})
+        if "before" not in v or "after" not in v:
+            return None
+        stem = pair_stem(key)
+        suffix = FORMAT_SUFFIX.get(self.settings.fmt, ".pdf")
+        return PairJob(v["before"], v["after"], stem, self.out_dir / f"{stem}_BeforeAndAfter{suffix}")
+
+    def _export(self, job: PairJob) -> None:
+        if self.manifest is not None and self.manifest.is_current(job, self.settings):
+            return
+        res = export_pair(job, self.settings)
+        if self.manifest is not None:
+            self.manifest.record(res, self.settings)
+        if self.on_result:
+            self.on_result(res)
+
+    def notice(self, names: Set[str]) -> None:
+        for name in names:
+            p = self.folder / name
+            if p.suffix.lower() in SUPPORTED_EXTS and pair_role(p):
+                self._pending[name] = ((-1, -1), time.monotonic())
+
+    def check_pending(self) -> List[PairJob]:
+        """Promote files that have settled; returns the pairs they completed (exported, or skipped as up to date)."""
+        now = time.monotonic()
+        done: List[PairJob] = []
+        for name, (last_sig, since) in list(self._pending.items()):
+            p = self.folder / name
+            try:
+                st = os.stat(p)
+            except OSError:
+                del self._pending[name]  # removed or renamed away before it settled
+                continue
+            sig = (st.st_size, st.st_mtime_ns)
+            if sig != last_sig:
+                self._pending[name] = (sig, now)
+                continue
+            if now - since < self.settle or st.st_size == 0:
+                continue
+            del self._pending[name]
+            key, role = pair_role(p)  # type: ignore[misc]
+            self._halves.setdefault(key, {})[role] = p
+            job = self._job(key)
+            if job is not None:
+                self._export(job)
+                done.append(job)
+        return done
+
+    def initial_scan(self) -> None:
+        """One listing at startup (and after lost events) so halves already present can pair with new arrivals."""
+        ready_since = time.monotonic() - self.settle  # settled unless the next stat shows a change
+        with os.scandir(self.folder) as it:
+            for e in it:
+                p = Path(e.path)
+                if not (e.is_file() and p.suffix.lower() in SUPPORTED_EXTS and pair_role(p)):
+                    continue
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue
+                self._pending[e.name] = ((st.st_size, st.st_mtime_ns), ready_since)
+
+    def run(self, stop: Optional[threading.Event] = None) -> None:
+        stop = stop or threading.Event()
+        backend = make_backend(self.folder, self.backend_kind)
+        try:
+            self.initial_scan()
+            while not stop.is_set():
+                self.check_pending()
+                timeout = min(self.poll_interval, self.settle / 2) if self._pending else self.poll_interval
+                names = backend.read(timeout)
+                if names is None:
+                    self.initial_scan()  # events were dropped: list the folder once to find what arrived meanwhile
+                else:
+                    self.notice(names)
+        finally:
+            backend.close()